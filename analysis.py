@@ -0,0 +1,66 @@
+import os
+
+from analysis_cache import make_cache_key
+from prompts import ACNE_ANALYSIS
+
+# Shared by the Streamlit analyzer page and the batch CLI so both send identical requests
+ANALYSIS_MODEL = "gpt-4o-mini"
+ACNE_ANALYSIS_PROMPT = ACNE_ANALYSIS.text
+# Completion budget for the structured reply; a full report is typically 350-600 tokens
+ANALYSIS_MAX_TOKENS = int(os.getenv("ANALYSIS_MAX_TOKENS", "900"))
+
+
+def analysis_cache_key(image, model=ANALYSIS_MODEL):
+    # Identical image bytes, prompt version, result schema and model always map to the same cached result
+    import json
+    from analysis_schema import ANALYSIS_SCHEMA
+
+    schema = json.dumps(ANALYSIS_SCHEMA, sort_keys=True)
+    return make_cache_key(model, ACNE_ANALYSIS.tag, ACNE_ANALYSIS_PROMPT, schema, image.detail, image.data)
+
+
+def analysis_request(image, model=ANALYSIS_MODEL, max_tokens=ANALYSIS_MAX_TOKENS):
+    # The system prompt is the stable, cacheable prefix; the image always comes after it.
+    # The reply is a JSON document in the analysis_schema format, bounded by max_tokens.
+    from analysis_schema import analysis_response_format
+
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "response_format": analysis_response_format(),
+        "messages": [
+            {"role": "system", "content": ACNE_ANALYSIS_PROMPT},
+            {"role": "user", "content": [
+                {"type": "text", "text": "Here is the image."},
+                {"type": "image_url", "image_url": {"url": image.data_url, "detail": image.detail}},
+            ]},
+        ],
+    }
+
+
+def analysis_result(text, finish_reason, usage):
+    # Cached, saved and rendered form of a reply: the validated fields plus a Markdown
+    # rendering for plain-text consumers (the batch CLI output, history summaries)
+    from analysis_schema import parse_analysis
+
+    analysis = parse_analysis(text, finish_reason)
+    return {"content": analysis.to_markdown(), "summary": analysis.summary, "analysis": analysis.model_dump(),
+            "usage": usage}
+
+
+def run_analysis_job(job, client, image, cache=None, key=None, model=ANALYSIS_MODEL):
+    # Runs on a jobs.JobQueue worker: streams into job.text so the page can show progress,
+    # and stores the result in the shared cache so it outlives the job and the session
+    from llm_client import CompletionStream, usage_to_dict
+
+    def on_wait(seconds, reason):
+        job.notice = f"High demand right now: your request is queued for ~{seconds:.0f}s ({reason})."
+
+    stream = CompletionStream(client, "acne_analysis", on_wait=on_wait, **analysis_request(image, model))
+    for delta in stream:
+        job.text += delta
+    result = analysis_result(stream.text, stream.finish_reason, usage_to_dict(stream.usage))
+    if cache is not None:
+        cache.set(key, result)
+    return {**result, "time_to_first_token": stream.time_to_first_token, "total_time": stream.total_time,
+            "queued_time": stream.queued_time}
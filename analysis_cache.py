@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from cachetools import TTLCache
+
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", ".analysis_cache")
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+ANALYSIS_CACHE_MEMORY_ITEMS = int(os.getenv("ANALYSIS_CACHE_MEMORY_ITEMS", "256"))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+
+def make_cache_key(*parts):
+    # Length-prefix every part so ("ab", "c") and ("a", "bc") hash differently
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    # Two-tier result cache: an in-memory LRU with TTL in front of a size-bounded
+    # directory of JSON files. Disk entries are evicted least-recently-used first
+    # (reads touch the file's mtime) once the directory exceeds max_disk_bytes.
+
+    def __init__(self, directory=ANALYSIS_CACHE_DIR, memory_items=ANALYSIS_CACHE_MEMORY_ITEMS,
+                 ttl=ANALYSIS_CACHE_TTL, max_disk_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = TTLCache(maxsize=memory_items, ttl=ttl)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _disk_entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self._disk_bytes -= size
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if time.time() - entry["created"] > self.ttl:
+            self._remove(path)
+            return None
+        os.utime(path)
+        return entry["value"]
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self.memory_hits += 1
+                return value
+            value = self._read_disk(key)
+            if value is not None:
+                self.disk_hits += 1
+                self._memory[key] = value
+                return value
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        data = json.dumps({"created": time.time(), "value": value}).encode("utf-8")
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            self._memory[key] = value
+            if os.path.exists(path):
+                self._remove(path)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(data)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # Trim to 90% of the budget so a burst of writes doesn't rescan on every set
+        target = self.max_disk_bytes * 0.9
+        entries = self._disk_entries()
+        self._disk_bytes = sum(size for _, _, size in entries)
+        for path, _, _ in sorted(entries, key=lambda entry: entry[1]):
+            if self._disk_bytes <= target:
+                break
+            self._remove(path)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
@@ -0,0 +1,155 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Every analysis a user runs is saved here so it can be reopened later without another
+# upstream call. An embedded SQLite database indexed by (username, created) keeps page
+# reads and lookups by id in the millisecond range however many entries a user has;
+# each row carries a small thumbnail instead of the uploaded image. Structured results
+# keep their fields as JSON (queryable with json_extract) and their stage in a column.
+
+ANALYSIS_HISTORY_DB = os.getenv("ANALYSIS_HISTORY_DB", "analysis_history.db")
+ANALYSIS_HISTORY_PAGE_SIZE = int(os.getenv("ANALYSIS_HISTORY_PAGE_SIZE", "10"))
+ANALYSIS_HISTORY_THUMBNAIL_EDGE = int(os.getenv("ANALYSIS_HISTORY_THUMBNAIL_EDGE", "128"))
+SUMMARY_CHARS = 160
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    created REAL NOT NULL,
+    image_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    summary TEXT NOT NULL,
+    content TEXT NOT NULL,
+    stage TEXT,
+    analysis TEXT
+);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    analysis_id INTEGER PRIMARY KEY REFERENCES analyses (id) ON DELETE CASCADE,
+    data BLOB NOT NULL
+);
+"""
+# Columns added after the first release, for databases created before them
+MIGRATIONS = [("stage", "TEXT"), ("analysis", "TEXT")]
+INDEXES = """
+CREATE INDEX IF NOT EXISTS analyses_by_user ON analyses (username, created DESC, id DESC);
+CREATE INDEX IF NOT EXISTS analyses_by_stage ON analyses (username, stage, created DESC, id DESC);
+-- Re-analyzing the same photo with the same prompt and model refreshes the entry
+CREATE UNIQUE INDEX IF NOT EXISTS analyses_by_image ON analyses (username, image_hash, prompt, model);
+"""
+
+# Page rows carry the summary and thumbnail but not the full result text
+LIST_COLUMNS = ("a.id, a.created, a.image_hash, a.model, a.prompt, a.prompt_tokens, a.completion_tokens, "
+                "a.cached_tokens, a.stage, a.summary, t.data AS thumbnail")
+
+
+def summarize_result(content, limit=SUMMARY_CHARS):
+    text = " ".join(line.strip("#*- ").strip() for line in content.splitlines() if line.strip())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+class AnalysisHistory:
+    def __init__(self, path=ANALYSIS_HISTORY_DB):
+        self.path = path
+        # sqlite3 connections can't be shared between threads; each script thread and
+        # job worker gets its own
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(analyses)")}
+            for name, kind in MIGRATIONS:
+                if name not in columns:
+                    connection.execute(f"ALTER TABLE analyses ADD COLUMN {name} {kind}")
+            connection.executescript(INDEXES)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.row_factory = sqlite3.Row
+            # WAL lets page reads proceed while a worker is writing a new result
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+        return connection
+
+    def add(self, username, image_hash, result, thumbnail, model, prompt, created=None):
+        usage = result.get("usage") or {}
+        analysis = result.get("analysis")
+        row = (
+            username, created or time.time(), image_hash, model, prompt,
+            usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), usage.get("cached_tokens", 0),
+            summarize_result(result.get("summary") or result["content"]), result["content"],
+            analysis.get("stage") if analysis else None, json.dumps(analysis) if analysis else None,
+        )
+        with self._connection() as connection:
+            analysis_id = connection.execute(
+                "INSERT INTO analyses (username, created, image_hash, model, prompt, prompt_tokens, "
+                "completion_tokens, cached_tokens, summary, content, stage, analysis) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (username, image_hash, prompt, model) DO UPDATE SET created = excluded.created, "
+                "prompt_tokens = excluded.prompt_tokens, completion_tokens = excluded.completion_tokens, "
+                "cached_tokens = excluded.cached_tokens, summary = excluded.summary, content = excluded.content, "
+                "stage = excluded.stage, analysis = excluded.analysis "
+                "RETURNING id",
+                row,
+            ).fetchone()[0]
+            connection.execute("INSERT OR REPLACE INTO thumbnails (analysis_id, data) VALUES (?, ?)",
+                               (analysis_id, thumbnail))
+        return analysis_id
+
+    @staticmethod
+    def _filter(username, stage):
+        # stage narrows to one acne stage; both filters are served by an index
+        if stage is None:
+            return "username = ?", (username,)
+        return "username = ? AND stage = ?", (username, stage)
+
+    def count(self, username, stage=None):
+        where, params = self._filter(username, stage)
+        return self._connection().execute(f"SELECT COUNT(*) FROM analyses WHERE {where}", params).fetchone()[0]
+
+    def page(self, username, page=1, page_size=ANALYSIS_HISTORY_PAGE_SIZE, stage=None):
+        # Newest first; 1-based page numbers. Reads only the rows on the requested page.
+        # The ids are picked from the (username, created) index alone, so skipping to a
+        # late page steps over index entries rather than whole rows
+        where, params = self._filter(username, stage)
+        rows = self._connection().execute(
+            f"SELECT {LIST_COLUMNS} FROM analyses a LEFT JOIN thumbnails t ON t.analysis_id = a.id "
+            f"WHERE a.id IN (SELECT id FROM analyses WHERE {where} ORDER BY created DESC, id DESC "
+            "LIMIT ? OFFSET ?) ORDER BY a.created DESC, a.id DESC",
+            (*params, page_size, (page - 1) * page_size),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, username, analysis_id):
+        row = self._connection().execute(
+            f"SELECT {LIST_COLUMNS}, a.content, a.analysis FROM analyses a "
+            "LEFT JOIN thumbnails t ON t.analysis_id = a.id WHERE a.id = ? AND a.username = ?",
+            (analysis_id, username),
+        ).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["analysis"] = json.loads(entry["analysis"]) if entry["analysis"] else None
+        return entry
+
+    def stats(self):
+        connection = self._connection()
+        entries, users = connection.execute("SELECT COUNT(*), COUNT(DISTINCT username) FROM analyses").fetchone()
+        thumbnail_bytes = connection.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM thumbnails").fetchone()[0]
+        return {
+            "entries": entries,
+            "users": users,
+            "thumbnail_bytes": thumbnail_bytes,
+            "database_bytes": sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal")
+                                  if os.path.exists(self.path + suffix)),
+        }
@@ -0,0 +1,153 @@
+import json
+from typing import Literal, Optional, get_args
+
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+# Typed result of the acne analysis call. The same models give the JSON schema sent as
+# the request's response_format (strict mode: every field required, no extra keys),
+# validate the reply, and render it, so nothing downstream parses free-form text.
+
+Region = Literal["forehead", "cheeks", "nose", "chin", "jawline"]
+Stage = Literal["clear", "mild", "moderate", "severe"]
+STAGES = get_args(Stage)
+
+
+class AnalysisFormatError(ValueError):
+    pass
+
+
+class _Strict(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+
+class RegionFinding(_Strict):
+    region: Region
+    acne_types: list[str]
+    notes: str
+
+    def to_markdown(self):
+        return f"- **{self.region.title()}**: {', '.join(self.acne_types)}. {self.notes}"
+
+
+class SkincareRoutine(_Strict):
+    morning: list[str]
+    evening: list[str]
+
+
+class AcneAnalysis(_Strict):
+    is_skin_photo: bool
+    decline_reason: str
+    regions: list[RegionFinding]
+    stage: Optional[Stage]
+    stage_reason: str
+    skincare: SkincareRoutine
+    diet: list[str]
+    lifestyle: list[str]
+    see_dermatologist: list[str]
+
+    @property
+    def summary(self):
+        if not self.is_skin_photo:
+            return self.decline_reason
+        return f"{(self.stage or 'unknown').title()} acne. {self.stage_reason}"
+
+    def to_markdown(self):
+        if not self.is_skin_photo:
+            return self.decline_reason
+
+        def bullets(items):
+            return [f"- {item}" for item in items] or ["- None"]
+
+        lines = ["#### Acne type by area"]
+        lines += [finding.to_markdown() for finding in self.regions] or ["- No active acne found."]
+        lines += ["", "#### Stage", _stage_line(self.stage, self.stage_reason)]
+        lines += ["", "#### Skincare routine", "**Morning**", *bullets(self.skincare.morning),
+                  "", "**Evening**", *bullets(self.skincare.evening)]
+        lines += ["", "#### Diet", *bullets(self.diet)]
+        lines += ["", "#### Lifestyle", *bullets(self.lifestyle)]
+        lines += ["", "#### When to see a dermatologist", *bullets(self.see_dermatologist)]
+        return "\n".join(lines)
+
+
+def _stage_line(stage, reason):
+    return f"**{(stage or 'unknown').title()}**: {reason}"
+
+
+ANALYSIS_SCHEMA = AcneAnalysis.model_json_schema()
+
+
+def analysis_response_format():
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "acne_analysis", "strict": True, "schema": ANALYSIS_SCHEMA},
+    }
+
+
+def parse_analysis(text, finish_reason=None):
+    # A reply cut off by max_tokens is never valid JSON; say so rather than report a parse error
+    if finish_reason == "length":
+        raise AnalysisFormatError("the analysis reached its token limit before it was complete")
+    try:
+        return AcneAnalysis.model_validate_json(text)
+    except ValidationError as exc:
+        raise AnalysisFormatError(f"the analysis did not match its schema ({exc.error_count()} errors)") from exc
+
+
+_decoder = json.JSONDecoder()
+
+
+def _skip(text, pos):
+    while pos < len(text) and text[pos] in " \t\r\n,":
+        pos += 1
+    return pos
+
+
+def _complete_items(text, pos):
+    # The finished elements of an array that is still streaming
+    items = []
+    pos = _skip(text, pos + 1)
+    while True:
+        try:
+            item, pos = _decoder.raw_decode(text, pos)
+        except ValueError:
+            return items
+        items.append(item)
+        pos = _skip(text, pos)
+
+
+def partial_fields(text):
+    # Top-level fields of a reply that is still streaming, each decoded once its value closes.
+    # Strict mode emits fields in schema order, so regions arrive first, one finding at a time.
+    fields = {}
+    pos = _skip(text, text.find("{") + 1) if "{" in text else len(text)
+    while pos < len(text):
+        key = None
+        try:
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            if text[pos:pos + 1] != ":":
+                break
+            pos = _skip(text, pos + 1)
+            fields[key], pos = _decoder.raw_decode(text, pos)
+        except ValueError:
+            if key == "regions" and text[pos:pos + 1] == "[":
+                fields[key] = _complete_items(text, pos)
+            break
+        pos = _skip(text, pos)
+    return fields
+
+
+def partial_markdown(text):
+    # The acne-by-area and stage sections, as far as they have arrived
+    fields = partial_fields(text)
+    if fields.get("is_skin_photo") is False or "regions" not in fields:
+        return ""
+    lines = ["#### Acne type by area"]
+    for item in fields["regions"]:
+        try:
+            lines.append(RegionFinding.model_validate(item).to_markdown())
+        except ValidationError:
+            pass
+    if "stage_reason" in fields:
+        lines += ["", "#### Stage", _stage_line(fields.get("stage"), fields["stage_reason"])]
+    return "\n".join(lines)
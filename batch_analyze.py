@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import toml
+from dotenv import load_dotenv
+
+from analysis import ANALYSIS_MODEL, analysis_cache_key, analysis_request, analysis_result
+from analysis_cache import AnalysisCache
+from face_screen import FACE_SCREEN_ENABLED, screen_image
+from image_utils import prepare_image
+from llm_client import create_async_openai_client, record_request_metrics, request_bytes, usage_to_dict
+from prompts import prompt_tag
+from rate_limit import async_call_with_retry, settle_usage
+
+# Headless counterpart of the "Acne Analysis" page: analyzes every image under the
+# given folders concurrently and appends one JSON line per image to the output file.
+# Re-running with the same output file skips images that already succeeded.
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SECRETS_FILE = os.path.join(".streamlit", "secrets.toml")
+
+
+def resolve_api_key(api_key=None):
+    load_dotenv()
+    if api_key or os.getenv("OPENAI_API_KEY"):
+        return api_key or os.getenv("OPENAI_API_KEY")
+    try:
+        return toml.load(SECRETS_FILE)["general"]["OPENAI_API_KEY"]
+    except (FileNotFoundError, KeyError):
+        sys.exit("No API key: pass --api-key, set OPENAI_API_KEY or add it to .streamlit/secrets.toml")
+
+
+def find_images(paths):
+    images = []
+    for path in paths:
+        if os.path.isfile(path):
+            images.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            images.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(images)
+
+
+def load_completed(output_path):
+    completed = set()
+    try:
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partially written line from an interrupted run
+                if record.get("status") == "ok":
+                    completed.add(record["path"])
+    except FileNotFoundError:
+        pass
+    return completed
+
+
+class NotAFace(Exception):
+    pass
+
+
+async def analyze_file(client, cache, path, model, screen=True):
+    with open(path, "rb") as f:
+        data = f.read()
+    if screen:
+        result = await asyncio.to_thread(screen_image, data)
+        if not result.passed:
+            raise NotAFace(f"pre-screen score {result.score:.3f} below {result.threshold}")
+    # Pillow work runs off the event loop so uploads keep flowing while images decode
+    image = await asyncio.to_thread(prepare_image, data)
+    key = analysis_cache_key(image, model)
+    if cache is not None:
+        result = cache.get(key)
+        if result is not None:
+            return {**result, "cached": True}
+
+    start = time.perf_counter()
+    request = analysis_request(image, model)
+    response, stats, estimated = await async_call_with_retry(client.chat.completions.create, request)
+    settle_usage(estimated, response.usage)
+    usage = usage_to_dict(response.usage)
+    record_request_metrics(name="batch_analysis", model=model, prompt=prompt_tag(request), total_time=time.perf_counter() - start,
+                           queued_time=stats.queued_time, attempts=stats.attempts,
+                           request_bytes=request_bytes(request), **usage)
+    choice = response.choices[0]
+    result = {**analysis_result(choice.message.content, choice.finish_reason, usage), "queued_time": stats.queued_time,
+              "crop_ratio": round(image.crop_ratio, 3), "bytes_saved": image.bytes_saved,
+              "tiles_saved": image.tiles_saved}
+    if cache is not None:
+        cache.set(key, result)
+    return {**result, "cached": False}
+
+
+async def run_batch(paths, output_path, client, concurrency=8, model=ANALYSIS_MODEL, cache=None, progress=True,
+                    screen=FACE_SCREEN_ENABLED):
+    completed = load_completed(output_path)
+    images = find_images(paths)
+    pending = [path for path in images if path not in completed]
+    queue = asyncio.Queue()
+    for path in pending:
+        queue.put_nowait(path)
+    counts = {"ok": 0, "error": 0, "rejected": 0, "skipped": len(images) - len(pending)}
+    start = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        async def worker():
+            while True:
+                try:
+                    path = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                record = {"path": path, "model": model}
+                image_start = time.perf_counter()
+                try:
+                    record.update(await analyze_file(client, cache, path, model, screen))
+                    record["status"] = "ok"
+                except NotAFace as exc:
+                    record.update(status="rejected", error=str(exc))
+                except Exception as exc:  # unreadable images and API errors: record and keep going
+                    record.update(status="error", error=f"{type(exc).__name__}: {exc}")
+                record["elapsed"] = round(time.perf_counter() - image_start, 3)
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                counts[record["status"]] += 1
+                if progress:
+                    done = counts["ok"] + counts["error"] + counts["rejected"]
+                    print(f"\r{done}/{len(pending)} analyzed, {counts['rejected']} rejected, {counts['error']} errors",
+                          end="", file=sys.stderr)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    if progress and pending:
+        print(file=sys.stderr)
+    counts["elapsed"] = time.perf_counter() - start
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze folders of face images without the Streamlit UI")
+    parser.add_argument("paths", nargs="+", help="Image files or folders to scan recursively")
+    parser.add_argument("-o", "--output", default="analysis_results.jsonl", help="JSONL file to append results to")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Maximum requests in flight")
+    parser.add_argument("--model", default=ANALYSIS_MODEL)
+    parser.add_argument("--api-key")
+    parser.add_argument("--base-url", help="Override the API endpoint, e.g. a local mock server")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the shared analysis result cache")
+    parser.add_argument("--no-screen", action="store_true", help="Send every image, even ones that fail the face pre-screen")
+    args = parser.parse_args()
+
+    client = create_async_openai_client(resolve_api_key(args.api_key), base_url=args.base_url)
+    cache = None if args.no_cache else AnalysisCache()
+    counts = asyncio.run(run_batch(args.paths, args.output, client, args.concurrency, args.model, cache,
+                                   screen=FACE_SCREEN_ENABLED and not args.no_screen))
+    rate = (counts["ok"] + counts["error"]) / counts["elapsed"] * 3600 if counts["elapsed"] else 0
+    print(f"{counts['ok']} analyzed, {counts['rejected']} not faces, {counts['error']} failed, "
+          f"{counts['skipped']} already done "
+          f"in {counts['elapsed']:.1f}s ({rate:.0f} images/hour)")
+
+
+if __name__ == "__main__":
+    main()
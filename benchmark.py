@@ -0,0 +1,1426 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+import pandas as pd
+
+from credentials_store import CredentialStore, CREDENTIAL_FIELDS
+from image_utils import prepare_image, format_bytes
+from mock_openai_server import MockOpenAIServer
+from password_hashing import PasswordHasher, PasswordHasherBusy
+
+SAMPLE_IMAGES = ["Health-care.jpg", "IMG_5251.jpeg.jpg", "hologram-feminine-silhouette-man-hand.jpg"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def write_fake_credentials(path, users):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CREDENTIAL_FIELDS)
+        for i in range(users):
+            writer.writerow([f"user{i}", f"user{i}@example.com", f"pw{i}", "What is your pet's name?", f"cat{i}"])
+
+
+def legacy_authenticate(path, username, password):
+    credentials = pd.read_csv(path)
+    user = credentials[(credentials["username"] == username) & (credentials["password"] == password)]
+    return not user.empty
+
+
+def bench_credentials(args):
+    import threading
+
+    print(f"{'users':>10} {'cold load ms':>14} {'login p50 ms':>14} {'login p99 ms':>14} {'legacy ms':>12} "
+          f"{'compact ms':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for users in args.sizes:
+            path = os.path.join(tmp, f"credentials_{users}.csv")
+            write_fake_credentials(path, users)
+            store = CredentialStore(path)
+
+            start = time.perf_counter()
+            store.refresh()
+            cold = time.perf_counter() - start
+
+            samples = []
+            for i in range(args.logins):
+                username = f"user{(i * 7919) % users}"
+                start = time.perf_counter()
+                assert store.get_user(username)["password"] == f"pw{username[4:]}"
+                samples.append(time.perf_counter() - start)
+            stats = summarize(samples)
+
+            legacy = ""
+            if users <= args.legacy_max:
+                start = time.perf_counter()
+                legacy_authenticate(path, "user0", "pw0")
+                legacy = f"{(time.perf_counter() - start) * 1000:.2f}"
+
+            # Compaction (run after password migrations and resets) while logins keep
+            # looking users up; none of them may miss
+            done, misses = threading.Event(), []
+
+            def login_during_compaction():
+                while not done.is_set():
+                    if store.get_user(f"user{users - 1}") is None:
+                        misses.append(1)
+
+            reader = threading.Thread(target=login_during_compaction)
+            reader.start()
+            store.update_user("user0", password="pw0")
+            start = time.perf_counter()
+            store.compact()
+            compact = time.perf_counter() - start
+            done.set()
+            reader.join()
+            assert not misses, f"{len(misses)} lookups missed an existing user during compaction"
+
+            print(f"{users:>10} {cold * 1000:>14.2f} {stats['p50_ms']:>14.4f} {stats['p99_ms']:>14.4f} {legacy:>12} "
+                  f"{compact * 1000:>11.1f}")
+
+
+def _signup_worker(path, worker, count):
+    store = CredentialStore(path, compact_after=0)
+    store.refresh()
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        store.add_user(f"new{worker}_{i}", f"new{worker}_{i}@example.com", "pw", "What is your pet's name?", "cat")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_signup(args):
+    print(f"{'users':>10} {'sign-ups':>10} {'p50 ms':>10} {'p99 ms':>10} {'lost rows':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for users in args.sizes:
+            path = os.path.join(tmp, f"credentials_{users}.csv")
+            write_fake_credentials(path, users)
+            with multiprocessing.Pool(args.workers) as pool:
+                results = pool.starmap(_signup_worker, [(path, w, args.signups) for w in range(args.workers)])
+            samples = [sample for result in results for sample in result]
+            stats = summarize(samples)
+            expected = users + args.workers * args.signups
+            lost = expected - len(CredentialStore(path))
+            print(f"{users:>10} {len(samples):>10} {stats['p50_ms']:>10.3f} {stats['p99_ms']:>10.3f} {lost:>10}")
+
+
+def bench_hashing(args):
+    from concurrent.futures import ThreadPoolExecutor
+
+    cores = os.cpu_count() or 1
+    print(f"{'rounds':>7} {'verify p50 ms':>14} {'logins/s/core':>14} {'pool logins/s':>14} {'busy':>6}")
+    for rounds in args.rounds:
+        hasher = PasswordHasher(rounds=rounds, workers=args.workers or cores)
+        stored = hasher.hash("correct horse")
+        samples = []
+        for _ in range(args.logins):
+            start = time.perf_counter()
+            assert hasher.verify("correct horse", stored)
+            samples.append(time.perf_counter() - start)
+        stats = summarize(samples)
+
+        # Concurrent login storm: many script threads verifying through the shared pool
+        busy = 0
+
+        def login(_):
+            nonlocal busy
+            try:
+                hasher.verify("correct horse", stored)
+            except PasswordHasherBusy:
+                busy += 1
+
+        storm = args.logins * cores
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.sessions) as sessions:
+            list(sessions.map(login, range(storm)))
+        elapsed = time.perf_counter() - start
+        hasher.shutdown()
+        per_core = 1000 / stats["mean_ms"] if stats["mean_ms"] else 0
+        print(f"{rounds:>7} {stats['p50_ms']:>14.2f} {per_core:>14.1f} {(storm - busy) / elapsed:>14.1f} {busy:>6}")
+
+
+FACE_SAMPLES = ["uploaded_image.png"]
+NOT_FACE_SAMPLES = ["Health-care.jpg", "IMG_5251.jpeg.jpg"]
+# Skin other than a face (a hand) that the analyzer accepts and the screen must let through
+SKIN_SAMPLES = ["hologram-feminine-silhouette-man-hand.jpg"]
+# The app's own logo, whole and cropped: the screen must reject every one of these
+MUST_REJECT_SAMPLES = ["IMG_5251.jpeg.jpg"]
+
+
+def portrait_framing(skin, rng, hand=False, scale=1.0):
+    # Synthetic portrait: the skin photo as an oval face taking up a quarter of a busy
+    # backdrop (scale shrinks it towards the centre), optionally with a patch of the same
+    # skin lower right standing in for a raised hand. Returns the image and the face's box.
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    backdrop = Image.fromarray(np.clip(rng.normal(rng.integers(40, 200, 3), 25, (600, 450, 3)),
+                                       0, 255).astype(np.uint8))
+    face = skin.resize((int(260 * scale), int(330 * scale)))
+    left, top = 225 - face.width // 2, 275 - face.height // 2
+    oval = Image.new("L", face.size, 0)
+    ImageDraw.Draw(oval).ellipse((0, 0, *face.size), fill=255)
+    backdrop.paste(face, (left, top), oval)
+    if hand:
+        palm = skin.resize((110, 130))
+        mask = Image.new("L", palm.size, 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, *palm.size), fill=255)
+        backdrop.paste(palm, (320, 450), mask)
+    return backdrop, (left, top, left + face.width, top + face.height)
+
+
+def labeled_screen_set(seed=0):
+    # Synthetic, built from the bundled images: skin close-ups re-lit across a range of
+    # skin tones, cropped and recompressed, and framed as faces of shrinking size as positives; the bundled graphics, crops of them and
+    # generated blank, gradient, noise, screenshot and landscape images as negatives
+    import io
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageEnhance
+
+    rng = np.random.default_rng(seed)
+
+    def jpeg(image, quality=80):
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+
+    def random_crop(image, min_fraction=0.5):
+        fraction = rng.uniform(min_fraction, 1.0)
+        width, height = int(image.width * fraction), int(image.height * fraction)
+        left, top = rng.integers(0, image.width - width + 1), rng.integers(0, image.height - height + 1)
+        return image.crop((left, top, left + width, top + height))
+
+    samples = []
+    for name in FACE_SAMPLES:
+        base = Image.open(name).convert("RGB")
+        # Darker tones scale all channels, keeping the skin's hue
+        for tone in (1.0, 0.85, 0.7, 0.55, 0.45, 0.35, 0.25):
+            for i in range(4):
+                image = random_crop(base)
+                toned = Image.fromarray((np.asarray(image, dtype=np.float32) * tone).astype(np.uint8))
+                toned = ImageEnhance.Brightness(toned).enhance(rng.uniform(0.85, 1.15))
+                samples.append((f"{name}[tone {tone}, crop {i}]", jpeg(toned, int(rng.integers(50, 95))), True))
+            for scale in (1.0, 0.6, 0.4):
+                backdrop, _ = portrait_framing(toned, rng, scale=scale)
+                samples.append((f"{name}[tone {tone}, portrait {scale:.0%}]", jpeg(backdrop), True))
+
+    for name in SKIN_SAMPLES:
+        # Whole images only: a random crop may leave the skin out
+        samples.append((name, jpeg(Image.open(name)), True))
+
+    for name in NOT_FACE_SAMPLES:
+        base = Image.open(name).convert("RGB")
+        samples.append((name, jpeg(base), False))
+        for i in range(4):
+            samples.append((f"{name}[crop {i}]", jpeg(random_crop(base, 0.3)), False))
+
+    for color in ((255, 255, 255), (0, 0, 0), (128, 128, 128), (230, 190, 170), (180, 120, 90)):
+        samples.append((f"blank{color}", jpeg(Image.new("RGB", (640, 480), color)), False))
+    for i in range(4):
+        a, b = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+        ramp = np.linspace(0, 1, 480)[:, None, None]
+        pixels = (a * (1 - ramp) + b * ramp) * np.ones((480, 640, 3))
+        samples.append((f"gradient {i}", jpeg(Image.fromarray(pixels.astype(np.uint8))), False))
+        samples.append((f"noise {i}", jpeg(Image.fromarray(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8))), False))
+
+        screenshot = Image.new("RGB", (1280, 800), tuple(int(c) for c in rng.integers(200, 256, 3)))
+        draw = ImageDraw.Draw(screenshot)
+        for _ in range(12):
+            x, y = int(rng.integers(0, 1100)), int(rng.integers(0, 700))
+            draw.rectangle((x, y, x + int(rng.integers(40, 300)), y + int(rng.integers(20, 120))),
+                           fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+        for line in range(30):
+            draw.text((40, 20 + line * 25), "Lorem ipsum dolor sit amet " * 3, fill=(30, 30, 30))
+        samples.append((f"screenshot {i}", jpeg(screenshot), False))
+
+        sky = np.linspace([90, 150, 230], [200, 225, 250], 240)[:, None, :] * np.ones((240, 640, 3))
+        ground = np.array([60, 120, 50]) + rng.normal(0, 18, (240, 640, 3))
+        landscape = np.clip(np.concatenate([sky, ground]), 0, 255).astype(np.uint8)
+        samples.append((f"landscape {i}", jpeg(Image.fromarray(landscape)), False))
+    return samples
+
+
+def bench_face_screen(args):
+    from face_screen import screen_image
+
+    if args.labeled:
+        samples = []
+        for label, is_face in (("face", True), ("not_face", False)):
+            for root, _, files in os.walk(os.path.join(args.labeled, label)):
+                for name in sorted(files):
+                    with open(os.path.join(root, name), "rb") as f:
+                        samples.append((os.path.join(label, name), f.read(), is_face))
+    else:
+        samples = labeled_screen_set()
+        print("SYNTHETIC set: every face is a re-toned, cropped or framed copy of one cheek close-up "
+              "(uploaded_image.png); pass --labeled with real photos for representative figures")
+
+    results = [(name, screen_image(data), is_face) for name, data, is_face in samples]
+    faces = sum(1 for _, _, is_face in results if is_face)
+    timing = summarize([result.elapsed for _, result, _ in results])
+    print(f"{len(results)} images ({faces} face, {len(results) - faces} not face), "
+          f"screen p50 {timing['p50_ms']:.1f} ms, p99 {timing['p99_ms']:.1f} ms")
+    print(f"{'threshold':>10} {'precision':>10} {'recall':>8} {'API calls skipped':>18}")
+    for threshold in args.thresholds:
+        passed = [(result.score >= threshold, is_face) for _, result, is_face in results]
+        true_positive = sum(1 for kept, is_face in passed if kept and is_face)
+        kept = sum(1 for kept, _ in passed if kept)
+        precision = true_positive / kept if kept else 1.0
+        recall = true_positive / faces if faces else 1.0
+        print(f"{threshold:>10.3f} {precision:>10.1%} {recall:>8.1%} {len(passed) - kept:>18}")
+    if args.verbose:
+        for name, result, is_face in sorted(results, key=lambda item: item[1].score):
+            print(f"{result.score:8.3f} {'face' if is_face else '-':>5} {name}")
+    if not args.labeled:
+        # At the configured threshold: the logo is always rejected, the hand always passes
+        rejected = [(name, result.score) for name, result, _ in results
+                    if name.startswith(tuple(MUST_REJECT_SAMPLES)) and result.passed]
+        missed = [(name, result.score) for name, result, _ in results if name in SKIN_SAMPLES and not result.passed]
+        assert not rejected, f"must-reject images pass the screen: {rejected}"
+        assert not missed, f"skin uploads rejected by the screen: {missed}"
+
+
+def bench_images(args):
+    import io
+    import numpy as np
+    from PIL import Image
+    from face_screen import face_region
+    from image_utils import load_image
+
+    samples = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            samples.append((os.path.basename(path), f.read(), None))
+    # The face photos bundled here are close-ups that fill the frame, so the crop is also
+    # measured on synthetic portraits made from them, with and without a hand in shot
+    rng = np.random.default_rng(0)
+    for name in FACE_SAMPLES if args.portraits else []:
+        skin = Image.open(name).convert("RGB")
+        for tone in (1.0, 0.55, 0.35):
+            toned = Image.fromarray((np.asarray(skin, dtype=np.float32) * tone).astype(np.uint8))
+            for hand in (False, True):
+                framed, face_box = portrait_framing(toned, rng, hand)
+                buffer = io.BytesIO()
+                framed.save(buffer, format="JPEG", quality=90)
+                label = f"{name}[synthetic portrait, tone {tone}{', hand' if hand else ''}]"
+                samples.append((label, buffer.getvalue(), face_box))
+
+    print(f"{'image':<60} {'before':>10} {'after':>10} {'tokens before':>14} {'tokens after':>13} "
+          f"{'crop':>6} {'bytes saved':>12} {'tiles saved':>12} {'face kept':>10} {'prep ms':>9}")
+    cropped = saved_bytes = saved_tiles = 0
+    for name, data, face_box in samples:
+        start = time.perf_counter()
+        image = prepare_image(data, max_edge=args.max_edge, image_format=args.format, quality=args.quality,
+                              crop=not args.no_crop)
+        elapsed = time.perf_counter() - start
+        # Share of the known face box that the crop keeps (synthetic portraits only)
+        face_kept = "-"
+        if face_box is not None:
+            box = (None if args.no_crop else face_region(load_image(data, args.max_edge))) or (0, 0, 10 ** 6, 10 ** 6)
+            overlap = (max(0, min(box[2], face_box[2]) - max(box[0], face_box[0]))
+                       * max(0, min(box[3], face_box[3]) - max(box[1], face_box[1])))
+            face_kept = f"{overlap / ((face_box[2] - face_box[0]) * (face_box[3] - face_box[1])):.0%}"
+        cropped += image.crop_ratio < 1
+        saved_bytes += image.bytes_saved > 0
+        saved_tiles += image.tiles_saved > 0
+        print(f"{name:<60} {format_bytes(image.original_size):>10} {format_bytes(image.size):>10} "
+              f"{image.original_estimated_tokens(args.model):>14} {image.estimated_tokens(args.model):>13} "
+              f"{image.crop_ratio:>6.0%} {format_bytes(image.bytes_saved):>12} {image.tiles_saved:>12} "
+              f"{face_kept:>10} {elapsed * 1000:>9.1f}")
+    print(f"cropped {cropped} of {len(samples)} images; the crop saved bytes on {saved_bytes} "
+          f"and image tiles on {saved_tiles}")
+
+
+def _count_media_bytes():
+    # Every st.image payload passes through the media file storage on each rerun; tally it
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    counter = {"bytes": 0}
+    original = MemoryMediaFileStorage.load_and_get_id
+
+    def load_and_get_id(storage, path_or_data, *args, **kwargs):
+        counter["bytes"] += len(path_or_data) if isinstance(path_or_data, bytes) else os.path.getsize(path_or_data)
+        return original(storage, path_or_data, *args, **kwargs)
+
+    MemoryMediaFileStorage.load_and_get_id = load_and_get_id
+    return counter
+
+
+def bench_previews(args):
+    import io
+    from PIL import Image
+    from image_utils import make_preview
+
+    def transfer_seconds(size):
+        return args.rtt_ms / 1000 + size * 8 / (args.bandwidth_kbps * 1000)
+
+    def decode_seconds(data):
+        start = time.perf_counter()
+        Image.open(io.BytesIO(data)).convert("RGB")
+        return time.perf_counter() - start
+
+    print(f"Slow link: {args.bandwidth_kbps} kbit/s, {args.rtt_ms} ms RTT; decode time stands in for paint time")
+    print(f"{'image':<44} {'original':>10} {'preview':>10} {'build ms':>9} {'transfer s':>16} {'decode ms':>16}")
+    uploads = {}
+    for path in args.images:
+        with open(path, "rb") as f:
+            data = f.read()
+        uploads[os.path.basename(path)] = data
+        start = time.perf_counter()
+        preview = make_preview(data, args.max_edge)
+        build = time.perf_counter() - start
+        print(f"{os.path.basename(path):<44} {format_bytes(len(data)):>10} {format_bytes(len(preview)):>10} "
+              f"{build * 1000:>9.1f} {transfer_seconds(len(data)):>7.2f} -> {transfer_seconds(len(preview)):<5.2f} "
+              f"{decode_seconds(data) * 1000:>7.1f} -> {decode_seconds(preview) * 1000:<6.1f}")
+
+    # Image bytes handed to the browser and script time per rerun, originals vs previews
+    import subprocess
+    env = {**os.environ, "PYTHONPATH": os.getcwd(), "FACE_SCREEN": "0"}
+    results = []
+    for max_edge in (0, args.max_edge):
+        output = subprocess.run([sys.executable, "-c", PREVIEW_RERUN_SCRIPT, str(args.reruns), *args.images],
+                                env={**env, "PREVIEW_MAX_EDGE": str(max_edge)},
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print(f"\n{'page':<56} {'bytes/rerun':>22} {'rerun ms':>18}")
+    for page, (original_bytes, original_ms) in results[0].items():
+        preview_bytes, preview_ms = results[1][page]
+        print(f"{page:<56} {format_bytes(original_bytes):>10} -> {format_bytes(preview_bytes):<9} "
+              f"{original_ms:>8.1f} -> {preview_ms:<7.1f}")
+
+
+PREVIEW_RERUN_SCRIPT = """
+import json, os, sys, time
+from streamlit.testing.v1 import AppTest
+from benchmark import _count_media_bytes, _e2e_app
+reruns, paths = int(sys.argv[1]), sys.argv[2:]
+counter = _count_media_bytes()
+results = {}
+for page, path in [("Login", None)] + [(f"Acne Analysis [{os.path.basename(p)}]", p) for p in paths]:
+    at = AppTest.from_function(_e2e_app, default_timeout=120)
+    at.secrets["general"] = {"OPENAI_API_KEY": "sk-mock"}
+    if path is not None:
+        at.session_state["logged_in"] = True
+        at.session_state["username"] = "bench"
+        at.session_state["page"] = "Acne Analysis"
+        with open(path, "rb") as f:
+            at.session_state["_bench_upload"] = {"file_id": page, "name": page, "type": "image/jpeg", "data": f.read()}
+    at.run()
+    counter["bytes"] = 0
+    start = time.perf_counter()
+    for _ in range(reruns):
+        at.run()
+    results[page] = (counter["bytes"] / reruns, (time.perf_counter() - start) / reruns * 1000)
+print(json.dumps(results))
+"""
+
+def bench_chat_history(args):
+    from chat_history import ChatHistory, create_summarizer
+    from llm_client import CompletionStream, create_openai_client
+
+    questions = [
+        "Does toothpaste help acne?", "Is benzoyl peroxide safe for sensitive skin?",
+        "How long until salicylic acid works?", "Should I moisturize oily skin?",
+    ]
+    with MockOpenAIServer(response_words=args.response_words) as server:
+        client = create_openai_client("sk-mock", base_url=server.base_url)
+        history = ChatHistory({}, create_summarizer(client, "gpt-4o-mini"), token_budget=args.budget)
+        messages = []
+        turn_prompt_tokens = []
+        for turn in range(args.turns):
+            messages.append({"role": "user", "content": f"{questions[turn % len(questions)]} (turn {turn})"})
+            stream = CompletionStream(client, "ai_dermatologist", model="gpt-4o-mini",
+                                      messages=history.build_messages("You are an AI Dermatologist.", messages))
+            for _ in stream:
+                pass
+            messages.append({"role": "assistant", "content": stream.text})
+            turn_prompt_tokens.append(stream.usage.prompt_tokens)
+        summaries = sum(1 for request in server.requests if not request["stream"])
+
+    print(f"turns: {args.turns}, token budget: {args.budget}, summary calls: {summaries}")
+    for turn in (0, 9, 49, 99, 149, 199):
+        if turn < len(turn_prompt_tokens):
+            print(f"  turn {turn + 1:>3}: {turn_prompt_tokens[turn]:>5} prompt tokens")
+    print(f"  max prompt tokens over all turns: {max(turn_prompt_tokens)}")
+    # History plus summary stays within the budget; the slack covers the system prompt and
+    # the gap between our token estimate and the server's count
+    limit = args.budget + args.slack
+    assert max(turn_prompt_tokens) <= limit, f"prompt grew to {max(turn_prompt_tokens)} tokens, over {limit}"
+
+
+def write_synthetic_images(directory, count, size=(1600, 1200)):
+    from PIL import Image
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        pixels = rng.integers(0, 256, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels).resize(size)
+        path = os.path.join(directory, f"synthetic_{i:05d}.jpg")
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def bench_batch(args):
+    import asyncio
+    from batch_analyze import run_batch
+    from llm_client import create_async_openai_client
+
+    with tempfile.TemporaryDirectory() as tmp, MockOpenAIServer(latency=args.latency) as server:
+        write_synthetic_images(tmp, args.images)
+        print(f"{'concurrency':>12} {'seconds':>9} {'images/hour':>12} {'errors':>7}")
+        for concurrency in args.concurrency:
+            output = os.path.join(tmp, f"results_{concurrency}.jsonl")
+            client = create_async_openai_client("sk-mock", base_url=server.base_url)
+            counts = asyncio.run(run_batch([tmp], output, client, concurrency, progress=False, screen=False))
+            rate = counts["ok"] / counts["elapsed"] * 3600
+            print(f"{concurrency:>12} {counts['elapsed']:>9.2f} {rate:>12.0f} {counts['error']:>7}")
+            resumed = asyncio.run(run_batch([tmp], output, client, concurrency, progress=False, screen=False))
+            assert resumed["skipped"] == args.images and resumed["ok"] == 0, "resume re-analyzed finished images"
+
+
+def check_batch(args):
+    import asyncio
+    import json
+    from PIL import Image
+    from batch_analyze import run_batch
+    from llm_client import create_async_openai_client
+
+    # Faces that pass the pre-screen, one flat-colour image it must reject and one
+    # unreadable file, run twice into the same output file
+    with tempfile.TemporaryDirectory() as tmp, MockOpenAIServer(latency=args.latency) as server:
+        faces = write_synthetic_images(tmp, args.images)
+        Image.new("RGB", (640, 480), (30, 60, 200)).save(os.path.join(tmp, "wall.jpg"))
+        with open(os.path.join(tmp, "broken.jpg"), "wb") as f:
+            f.write(b"not a jpeg")
+        output = os.path.join(tmp, "results.jsonl")
+        client = create_async_openai_client("sk-mock", base_url=server.base_url)
+
+        counts = asyncio.run(run_batch([tmp], output, client, args.concurrency, progress=False, screen=True))
+        with open(output, encoding="utf-8") as f:
+            records = {os.path.basename(record["path"]): record for record in map(json.loads, f)}
+        assert counts["ok"] == len(faces) and counts["rejected"] == 1 and counts["error"] == 1, counts
+        assert all(records[os.path.basename(path)]["status"] == "ok" and records[os.path.basename(path)]["analysis"]
+                   for path in faces), "a face image has no analysis"
+        assert records["wall.jpg"]["status"] == "rejected", records["wall.jpg"]
+        assert records["broken.jpg"]["status"] == "error", records["broken.jpg"]
+        assert len(server.requests) == len(faces), f"{len(server.requests)} requests for {len(faces)} faces"
+        assert server.max_in_flight == args.concurrency, \
+            f"{server.max_in_flight} requests in flight with concurrency {args.concurrency}"
+
+        # Resume skips finished images and retries only the ones that did not succeed
+        resumed = asyncio.run(run_batch([tmp], output, client, args.concurrency, progress=False, screen=True))
+        assert resumed["skipped"] == len(faces) and resumed["ok"] == 0, resumed
+        assert resumed["rejected"] == 1 and resumed["error"] == 1, resumed
+        assert len(server.requests) == len(faces), "resume sent finished images again"
+    print(f"batch check passed: {counts['ok']} ok, {counts['rejected']} rejected, {counts['error']} error, "
+          f"resume skipped {resumed['skipped']}, at most {server.max_in_flight} requests in flight")
+
+
+def bench_prompt_cache(args):
+    from analysis import analysis_request
+    from batch_analyze import resolve_api_key
+    from llm_client import CompletionStream, create_openai_client, usage_to_dict
+    from prompts import ACNE_ANALYSIS, DERMATOLOGIST, PROMPT_CACHE_MIN_TOKENS
+
+    images = [prepare_image(synthetic_image_bytes(50 * 1024, seed)) for seed in range(3)]
+    questions = ["Does toothpaste help acne?", "Is niacinamide safe with retinol?", "What causes milia?"]
+    requests = {
+        ACNE_ANALYSIS: [analysis_request(images[i % len(images)]) for i in range(args.requests)],
+        DERMATOLOGIST: [{"model": "gpt-4o-mini", "max_tokens": 100, "messages": [
+            {"role": "system", "content": DERMATOLOGIST.text},
+            {"role": "user", "content": questions[i % len(questions)]}]} for i in range(args.requests)],
+    }
+
+    def run(client):
+        print(f"{'prompt':<20} {'prefix tokens':>14} {'hit rate':>9} {'cached share':>13} "
+              f"{'TTFT miss ms':>13} {'TTFT hit ms':>12}")
+        for prompt, batch in requests.items():
+            prompt_tokens = cached_tokens = 0
+            first_token = {"hit": [], "miss": []}
+            for request in batch:
+                stream = CompletionStream(client, f"bench_{prompt.name}", **request)
+                for _ in stream:
+                    pass
+                usage = usage_to_dict(stream.usage)
+                prompt_tokens += usage["prompt_tokens"]
+                cached_tokens += usage["cached_tokens"]
+                first_token["hit" if usage["cached_tokens"] else "miss"].append(stream.time_to_first_token or 0)
+            hits = len(first_token["hit"])
+            note = "" if prompt.estimated_tokens >= PROMPT_CACHE_MIN_TOKENS else f" (< {PROMPT_CACHE_MIN_TOKENS})"
+            print(f"{prompt.tag:<20} {str(prompt.estimated_tokens) + note:>14} {hits / len(batch):>9.0%} "
+                  f"{cached_tokens / max(prompt_tokens, 1):>13.0%} {summarize(first_token['miss'])['p50_ms']:>13.1f} "
+                  f"{summarize(first_token['hit'])['p50_ms']:>12.1f}")
+
+    if args.base_url or args.api_key:
+        run(create_openai_client(resolve_api_key(args.api_key), base_url=args.base_url))
+        return
+    with MockOpenAIServer(latency=args.latency, response_words=20, cache_min_tokens=args.cache_min_tokens) as server:
+        run(create_openai_client("sk-mock", base_url=server.base_url))
+
+
+def bench_structured(args):
+    from analysis import analysis_request
+    from analysis_schema import AnalysisFormatError, parse_analysis
+    from batch_analyze import resolve_api_key
+    from llm_client import CompletionStream, create_openai_client, usage_to_dict
+
+    with open(args.image, "rb") as f:
+        image = prepare_image(f.read())
+    structured = analysis_request(image, max_tokens=args.max_tokens)
+    # The earlier request: same prompt and image, free-form reply with no completion budget
+    free_form = {key: value for key, value in structured.items() if key not in ("response_format", "max_tokens")}
+
+    def run(client):
+        print(f"{'mode':<12} {'n':>4} {'tokens p50':>11} {'tokens max':>11} {'total p50 s':>12} {'p95 s':>7} "
+              f"{'p99 s':>7} {'max s':>7} {'stdev s':>8} {'parsed':>7}")
+        for mode, request in (("free-form", free_form), ("structured", structured)):
+            totals, tokens, parsed = [], [], 0
+            for _ in range(args.requests):
+                stream = CompletionStream(client, f"bench_{mode}", **request)
+                for _ in stream:
+                    pass
+                totals.append(stream.total_time)
+                tokens.append(usage_to_dict(stream.usage)["completion_tokens"])
+                if mode == "structured":
+                    try:
+                        parse_analysis(stream.text, stream.finish_reason)
+                        parsed += 1
+                    except AnalysisFormatError:
+                        pass
+            stats = summarize(totals)
+            print(f"{mode:<12} {len(totals):>4} {percentile(tokens, 50):>11} {max(tokens):>11} "
+                  f"{stats['p50_ms'] / 1000:>12.2f} {stats['p95_ms'] / 1000:>7.2f} {stats['p99_ms'] / 1000:>7.2f} "
+                  f"{max(totals):>7.2f} {statistics.pstdev(totals):>8.2f} "
+                  f"{f'{parsed / len(totals):.0%}' if mode == 'structured' else '-':>7}")
+
+    if args.base_url or args.api_key:
+        run(create_openai_client(resolve_api_key(args.api_key), base_url=args.base_url))
+        return
+    # The mock varies free-form answer length log-normally to stand in for a model's spread
+    with MockOpenAIServer(latency=args.latency, token_delay=args.token_delay, response_words=args.response_words,
+                          response_words_spread=args.spread, seed=0) as server:
+        run(create_openai_client("sk-mock", base_url=server.base_url))
+
+
+def bench_coalesce(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from analysis import analysis_cache_key, run_analysis_job
+    from jobs import JobQueue
+    from llm_client import create_openai_client
+
+    photos = [prepare_image(synthetic_image_bytes(50 * 1024, seed)) for seed in range(args.photos)]
+    print(f"{'sessions':>9} {'photos':>7} {'coalesce':>9} {'upstream calls':>15} {'calls saved':>12} {'p50 s':>7}")
+    for coalesce in (False, True):
+        with MockOpenAIServer(latency=args.latency, response_words=40) as server:
+            client = create_openai_client("sk-mock", base_url=server.base_url)
+            queue = JobQueue(workers=args.sessions)
+
+            def session(i):
+                # Every session submits within the same couple of seconds, like a kiosk plus staff
+                time.sleep((i % 10) * args.spread / 10)
+                image = photos[i % len(photos)]
+                key = analysis_cache_key(image)
+                start = time.perf_counter()
+                job = queue.submit(lambda job: run_analysis_job(job, client, image), key=key if coalesce else None)
+                while not job.done:
+                    time.sleep(0.01)
+                return time.perf_counter() - start
+
+            with ThreadPoolExecutor(args.sessions) as pool:
+                samples = list(pool.map(session, range(args.sessions)))
+            queue.shutdown()
+            calls = len(server.requests)
+            print(f"{args.sessions:>9} {args.photos:>7} {'on' if coalesce else 'off':>9} {calls:>15} "
+                  f"{queue.stats()['coalesced']:>12} {statistics.median(samples):>7.2f}")
+
+
+def bench_session_memory(args):
+    from session_store import SessionStore, deep_sizeof
+
+    image = prepare_image(synthetic_image_bytes(200 * 1024))
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": "word " * 80} for i in range(args.turns)]
+    per_session = deep_sizeof(messages) + deep_sizeof(image)
+    print(f"each session holds ~{format_bytes(per_session)} ({args.turns} chat turns + one prepared upload)")
+    print(f"{'sessions':>9} {'budget':>9} {'unbounded':>10} {'in memory':>10} {'on disk':>9} {'spills':>7} "
+          f"{'reload p50 ms':>14} {'get p50 ms':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for sessions in args.sessions:
+            store = SessionStore(budget=args.session_budget, global_budget=args.global_budget, directory=tmp)
+            for i in range(sessions):
+                store.set(f"s{i}", "messages", [dict(message) for message in messages])
+                store.set(f"s{i}", "prepared_upload", {"file_id": i, "image": image})
+            stats = store.stats()
+            samples = []
+            for i in range(min(sessions, 200)):
+                start = time.perf_counter()
+                store.get(f"s{i}", "messages")
+                samples.append(time.perf_counter() - start)
+            # Reads of a value already in memory, as on most reruns
+            hot_samples = []
+            for _ in range(200):
+                start = time.perf_counter()
+                store.get(f"s{sessions - 1}", "prepared_upload")
+                hot_samples.append(time.perf_counter() - start)
+            print(f"{sessions:>9} {format_bytes(args.global_budget):>9} {format_bytes(per_session * sessions):>10} "
+                  f"{format_bytes(stats['memory_bytes']):>10} {format_bytes(stats['disk_bytes']):>9} "
+                  f"{stats['spills']:>7} {summarize(samples)['p50_ms']:>14.2f} {summarize(hot_samples)['p50_ms']:>11.3f}")
+
+
+def bench_history(args):
+    import hashlib
+    import random
+    from analysis_history import AnalysisHistory, ANALYSIS_HISTORY_THUMBNAIL_EDGE
+    from image_utils import make_thumbnail
+
+    with open(args.image, "rb") as f:
+        upload = f.read()
+    thumbnail = make_thumbnail(prepare_image(upload).data, ANALYSIS_HISTORY_THUMBNAIL_EDGE)
+    content = " ".join(f"word{i}" for i in range(args.response_words))
+    rng = random.Random(0)
+    print(f"Thumbnail {format_bytes(len(thumbnail))} per entry vs {format_bytes(len(upload))} uploaded")
+    print(f"{'entries':>8} {'users':>6} {'insert ms':>10} {'page p50 ms':>12} {'page p99 ms':>12} "
+          f"{'last page p99':>14} {'open p50 ms':>12} {'open p99 ms':>12} {'db size':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for entries in args.entries:
+            history = AnalysisHistory(os.path.join(tmp, f"history_{entries}.db"))
+            # The measured user's entries are interleaved with other users', as in a shared database
+            start = time.perf_counter()
+            ids = []
+            for i in range(entries * args.users):
+                username = f"user{i % args.users}"
+                analysis_id = history.add(username, hashlib.sha256(str(i).encode()).hexdigest(),
+                                          {"content": content, "usage": {"prompt_tokens": 3000}},
+                                          thumbnail, "gpt-4o-mini", "acne_analysis@2", created=1_700_000_000 + i)
+                if username == "user0":
+                    ids.append(analysis_id)
+            insert = (time.perf_counter() - start) / (entries * args.users)
+
+            pages = max(1, -(-entries // args.page_size))
+            page_samples, last_samples, open_samples = [], [], []
+            for _ in range(args.reads):
+                start = time.perf_counter()
+                history.count("user0")
+                history.page("user0", rng.randint(1, pages), args.page_size)
+                page_samples.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                history.page("user0", pages, args.page_size)
+                last_samples.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                assert history.get("user0", rng.choice(ids))["content"] == content
+                open_samples.append(time.perf_counter() - start)
+            page, last, opened = summarize(page_samples), summarize(last_samples), summarize(open_samples)
+            print(f"{entries:>8} {args.users:>6} {insert * 1000:>10.3f} {page['p50_ms']:>12.3f} {page['p99_ms']:>12.3f} "
+                  f"{last['p99_ms']:>14.3f} {opened['p50_ms']:>12.3f} {opened['p99_ms']:>12.3f} "
+                  f"{format_bytes(history.stats()['database_bytes']):>10}")
+
+
+QUESTION_GROUPS = [
+    ["Does toothpaste help acne?", "Can toothpaste help with acne?", "does toothpaste help with pimples",
+     "Will toothpaste help my acne"],
+    ["Is benzoyl peroxide safe?", "is benzoyl peroxide safe", "Benzoyl peroxide - is it safe?",
+     "Is benzoyl peroxide safe to use?"],
+    ["How long does salicylic acid take to work?", "how long until salicylic acid works",
+     "How long does it take for salicylic acid to work?"],
+    ["Should I moisturize oily skin?", "Do I need to moisturize oily skin?", "should oily skin be moisturized"],
+    ["Does diet affect acne?", "Can diet cause acne?", "does my diet affect my acne"],
+    ["What causes blackheads?", "what causes blackheads on the nose"],
+    ["Should I pop pimples?", "should i pop my pimples", "Is it ok to pop pimples?"],
+]
+# Close to a cached question but asking something else; these must not be answered from it
+NEAR_MISS_QUESTIONS = [
+    "Does toothpaste cause acne?", "Is benzoyl peroxide safe for sensitive skin?", "What causes whiteheads?",
+    "Is salicylic acid safe during pregnancy?", "Should I exfoliate oily skin?", "Does diet affect eczema?",
+    "Is benzoyl peroxide safe for my baby?", "Is benzoyl peroxide safe for teenagers?",
+    "Is 10% benzoyl peroxide safe?", "Is benzoyl peroxide not safe?", "Does toothpaste not help acne?",
+    "Does diet affect acne in teens?", "Should I not pop pimples?", "Is it ok to not pop pimples?",
+    "Should I moisturize oily skin with retinol?", "How long does adapalene take to work?",
+]
+
+
+def bench_question_cache(args):
+    from question_cache import QuestionCache
+
+    # Each group's first phrasing is answered upstream; every other phrasing is a reworded
+    # repeat that should hit it, and must never get another group's answer
+    print(f"{'threshold':>10} {'reworded hits':>14} {'wrong answers':>14} {'lookup p50 us':>14}"
+          f"   ({len(NEAR_MISS_QUESTIONS)} near-miss questions also checked)")
+    for threshold in args.thresholds:
+        cache = QuestionCache(threshold=threshold)
+        for group, questions in enumerate(QUESTION_GROUPS):
+            cache.set(questions[0], group)
+        hits = wrong = total = 0
+        samples = []
+        for group, questions in enumerate(QUESTION_GROUPS):
+            for question in questions[1:]:
+                start = time.perf_counter()
+                answer, _ = cache.get(question)
+                samples.append(time.perf_counter() - start)
+                total += 1
+                hits += answer == group
+                wrong += answer is not None and answer != group
+        for question in NEAR_MISS_QUESTIONS:
+            answer, _ = cache.get(question)
+            wrong += answer is not None
+        print(f"{threshold:>10.2f} {f'{hits}/{total}':>14} {wrong:>14} {summarize(samples)['p50_ms'] * 1000:>14.1f}")
+
+    # Bounded memory: a stream of distinct questions never grows the cache past max_entries
+    cache = QuestionCache(max_entries=args.max_entries)
+    for i in range(args.questions):
+        cache.set(f"question number {i} about skin type {i % 7}", i)
+    stats = cache.stats()
+    print(f"{args.questions} distinct questions: {stats['entries']} entries kept, {stats['evictions']} evicted (LRU)")
+
+
+def _e2e_app():
+    # Runs v4.py under AppTest. AppTest can't drive st.file_uploader, so the upload is
+    # injected from session state through a stand-in that returns a real UploadedFile.
+    import runpy
+    import streamlit as st
+    from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+
+    def bench_file_uploader(*args, **kwargs):
+        upload = st.session_state.get("_bench_upload")
+        return UploadedFile(UploadedFileRec(**upload), None) if upload else None
+
+    st.file_uploader = bench_file_uploader
+    runpy.run_path("v4.py", run_name="__main__")
+
+
+def synthetic_image_bytes(target_bytes, seed=0):
+    # Noise JPEGs barely compress, so the file size tracks the pixel count closely
+    from PIL import Image
+    import io
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    side = 256
+    for _ in range(3):
+        pixels = rng.integers(0, 256, (side, side, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+        side = max(64, int(side * (target_bytes / buffer.tell()) ** 0.5))
+    return buffer.getvalue()
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+
+    def run(self, name, app_test):
+        start = time.perf_counter()
+        app_test.run()
+        elapsed = time.perf_counter() - start
+        if app_test.exception:
+            raise RuntimeError(f"{name} raised: {app_test.exception[0].message}")
+        self.samples.setdefault(name, []).append(elapsed)
+        return elapsed
+
+    def run_until(self, name, app_test, done, poll=0.05, timeout=120):
+        # For work that finishes in the background: rerun (as the page's polling fragment
+        # would) until done(app_test), timing from the first run to the one that shows it
+        start = time.perf_counter()
+        while True:
+            app_test.run()
+            if app_test.exception:
+                raise RuntimeError(f"{name} raised: {app_test.exception[0].message}")
+            if done(app_test):
+                break
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"{name} did not finish within {timeout}s")
+            time.sleep(poll)
+        elapsed = time.perf_counter() - start
+        self.samples.setdefault(name, []).append(elapsed)
+        return elapsed
+
+
+def bench_e2e(args):
+    from streamlit.testing.v1 import AppTest
+
+    workdir = tempfile.mkdtemp()
+    credentials_path = os.path.join(workdir, "credentials.csv")
+    shutil.copy("user_credentials.csv", credentials_path)
+    os.environ["CREDENTIALS_FILE"] = credentials_path
+    os.environ["ANALYSIS_CACHE_DIR"] = os.path.join(workdir, "analysis_cache")
+    os.environ["ANALYSIS_HISTORY_DB"] = os.path.join(workdir, "analysis_history.db")
+    if not args.with_cache:
+        os.environ["ANALYSIS_CACHE_TTL"] = "0"
+    # The sample and noise uploads aren't faces; time the full analysis path regardless
+    os.environ["FACE_SCREEN"] = "0"
+    sys.path.insert(0, os.getcwd())
+
+    images = {}
+    for path in args.images:
+        with open(path, "rb") as f:
+            images[os.path.basename(path)] = f.read()
+    for size_kb in args.synthetic_kb:
+        images[f"synthetic_{size_kb}KB"] = synthetic_image_bytes(size_kb * 1024, seed=size_kb)
+
+    timer = StageTimer()
+    totals = []
+    with MockOpenAIServer(latency=args.latency, token_delay=args.token_delay,
+                          response_words=args.response_words) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        for iteration in range(args.iterations):
+            iteration_start = time.perf_counter()
+            at = AppTest.from_function(_e2e_app, default_timeout=120)
+            at.secrets["general"] = {"OPENAI_API_KEY": "sk-mock"}
+            timer.run("cold_start", at)
+
+            at.sidebar.radio[0].set_value("Sign-Up")
+            timer.run("navigate", at)
+            username = f"bench_{os.getpid()}_{iteration}"
+            for field, value in zip(at.text_input, [username, f"{username}@example.com", "pw", "answer"]):
+                field.input(value)
+            at.button[0].click()
+            timer.run("sign_up", at)
+
+            at.sidebar.radio[0].set_value("Login")
+            timer.run("navigate", at)
+            at.text_input[0].input(username)
+            at.text_input[1].input("pw")
+            at.button[0].click()
+            timer.run("login", at)
+            if not at.session_state["logged_in"]:
+                raise RuntimeError("login failed during the benchmark")
+            timer.run("navigate", at)
+
+            for n, (label, data) in enumerate(images.items()):
+                at.session_state["_bench_upload"] = {
+                    "file_id": f"{iteration}-{n}", "name": f"{label}.jpg", "type": "image/jpeg", "data": data,
+                }
+                timer.run(f"upload_preview[{label}]", at)
+                at.button[0].click()
+                timer.run_until(f"analysis[{label}]", at, lambda at: len(at.success) > 0)
+            at.session_state["_bench_upload"] = None
+
+            at.sidebar.radio[0].set_value("AI Dermatologist")
+            timer.run("navigate", at)
+            for turn in range(args.chat_turns):
+                at.chat_input[0].set_value(f"Is benzoyl peroxide safe for sensitive skin? ({turn})")
+                timer.run("chat_turn", at)
+            totals.append(time.perf_counter() - iteration_start)
+
+    report = {
+        "created": time.time(),
+        "config": {key: value for key, value in vars(args).items() if key != "func"},
+        "image_bytes": {label: len(data) for label, data in images.items()},
+        "stages": {name: summarize(samples) for name, samples in timer.samples.items()},
+        "total": summarize(totals),
+    }
+    print(f"{'stage':<56} {'n':>4} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, stats in [*report["stages"].items(), ("total", report["total"])]:
+        print(f"{name:<56} {stats['count']:>4} {stats['p50_ms']:>10.1f} {stats['p95_ms']:>10.1f} {stats['p99_ms']:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved results to {args.output}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: p95 {before:.1f} ms -> {after:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+LOAD_QUESTIONS = [
+    "Is benzoyl peroxide safe for sensitive skin?",
+    "How long does adapalene take to work on acne?",
+    "Should I use salicylic acid in the morning or at night?",
+    "What moisturizer works for oily acne-prone skin?",
+    "Can diet cause breakouts on my chin?",
+    "How do I fade dark marks left by pimples?",
+]
+LOAD_FOLLOW_UPS = [
+    "How often should I apply it?",
+    "Can I combine that with a retinoid?",
+    "What if it makes my skin dry?",
+    "When should I see a dermatologist instead?",
+]
+
+
+class ResourceSampler:
+    # Samples this process's resident memory and CPU time in the background
+    def __init__(self, interval=0.25):
+        import threading
+
+        self.interval = interval
+        self.rss = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    @staticmethod
+    def current_rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.rss.append(self.current_rss())
+
+    def __enter__(self):
+        times = os.times()
+        self._cpu_start = times.user + times.system
+        self._wall_start = time.perf_counter()
+        self.rss.append(self.current_rss())
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        times = os.times()
+        self.cpu_seconds = times.user + times.system - self._cpu_start
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        self.rss.append(self.current_rss())
+
+
+def _share_app_test_runtime():
+    # AppTest installs a fresh mock Runtime for every run and removes it afterwards, so
+    # concurrent runs in one process tear each other's down. Install one shared mock for
+    # the whole load test, as a real server has, and point AppTest's setup at a stand-in.
+    from unittest.mock import MagicMock
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import app_test
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    app_test.Runtime = type("Runtime", (), {"_instance": None})
+
+    # Every AppTest runs as "test session id"; give each its own id, as real sessions
+    # have, so the per-session store and job ownership keep them apart
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+    original_init = LocalScriptRunner.__init__
+
+    def init_with_session_id(runner, script_path, session_state, *args, **kwargs):
+        original_init(runner, script_path, session_state, *args, **kwargs)
+        if not hasattr(session_state, "_bench_session_id"):
+            session_state._bench_session_id = uuid.uuid4().hex
+        runner._session_id = session_state._bench_session_id
+
+    LocalScriptRunner.__init__ = init_with_session_id
+    # Each run patches and restores this option; set it up front so every restore keeps it on
+    config.set_option("global.appTest", True)
+
+
+def _load_user_flow(user, flow, images, args, timer):
+    # One scripted visit: log in, upload and analyze a photo, a multi-turn chat, log out
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_function(_e2e_app, default_timeout=120)
+    at.secrets["general"] = {"OPENAI_API_KEY": "sk-mock"}
+    timer.run("cold_start", at)
+    at.text_input[0].input(f"load{user}")
+    at.text_input[1].input("pw")
+    at.button[0].click()
+    timer.run("login", at)
+    if not at.session_state["logged_in"]:
+        raise RuntimeError(f"login failed for load{user}")
+    timer.run("navigate", at)
+
+    label, data = images[(user + flow) % len(images)]
+    at.session_state["_bench_upload"] = {
+        "file_id": f"load-{user}-{flow}", "name": label, "type": "image/jpeg", "data": data,
+    }
+    timer.run("upload_preview", at)
+    at.button[0].click()
+    timer.run_until("analysis", at, lambda at: len(at.success) > 0 or len(at.error) > 0, poll=args.poll)
+    if at.error:
+        raise RuntimeError(at.error[0].value)
+    at.session_state["_bench_upload"] = None
+
+    at.sidebar.radio[0].set_value("AI Dermatologist")
+    timer.run("navigate", at)
+    questions = [LOAD_QUESTIONS[(user + flow) % len(LOAD_QUESTIONS)], *LOAD_FOLLOW_UPS]
+    for turn in range(args.chat_turns):
+        at.chat_input[0].set_value(questions[turn % len(questions)])
+        timer.run("chat_turn", at)
+        if at.error:
+            raise RuntimeError(at.error[0].value)
+    at.sidebar.button[0].click()
+    timer.run("logout", at)
+
+
+def bench_load(args):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    workdir = tempfile.mkdtemp()
+    credentials_path = os.path.join(workdir, "credentials.csv")
+    os.environ["CREDENTIALS_FILE"] = credentials_path
+    os.environ["ANALYSIS_CACHE_DIR"] = os.path.join(workdir, "analysis_cache")
+    os.environ["ANALYSIS_HISTORY_DB"] = os.path.join(workdir, "analysis_history.db")
+    os.environ["SESSION_SPILL_DIR"] = os.path.join(workdir, "session_spill")
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    if not args.with_cache:
+        os.environ["ANALYSIS_CACHE_TTL"] = "0"
+    # Only one of the sample uploads is a face; load the full analysis path regardless
+    os.environ["FACE_SCREEN"] = "0"
+    sys.path.insert(0, os.getcwd())
+    _share_app_test_runtime()
+
+    hasher = PasswordHasher(rounds=args.bcrypt_rounds)
+    password = hasher.hash("pw")
+    hasher.shutdown()
+    with open(credentials_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CREDENTIAL_FIELDS)
+        for user in range(max(args.users)):
+            writer.writerow([f"load{user}", f"load{user}@example.com", password, "What is your pet's name?", "cat"])
+
+    images = []
+    for path in args.images:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+
+    print(f"{'users':>6} {'flows':>6} {'failed':>7} {'flows/min':>10} {'rerun p50 ms':>13} {'rerun p95 ms':>13} "
+          f"{'rerun p99 ms':>13} {'analysis p95 s':>15} {'chat p95 s':>11} {'cpu cores':>10} {'rss MB':>8}")
+    steps = []
+    with MockOpenAIServer(latency=args.latency, token_delay=args.token_delay, response_words=args.response_words,
+                          error_rate=args.error_rate, seed=0) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        # Warm the imports and cached resources so the first step doesn't pay for them
+        _load_user_flow(0, 0, images, args, StageTimer())
+
+        for users in args.users:
+            timer = StageTimer()
+            failures = []
+            lock = threading.Lock()
+            deadline = time.perf_counter() + args.duration
+
+            def user_loop(user):
+                completed = flow = 0
+                # Stagger the arrivals so the sessions don't rerun in lockstep
+                time.sleep(user * args.ramp_up / users)
+                while time.perf_counter() < deadline:
+                    try:
+                        _load_user_flow(user, flow, images, args, timer)
+                        completed += 1
+                    except Exception as exc:
+                        with lock:
+                            failures.append(f"load{user}: {exc}")
+                    flow += 1
+                return completed
+
+            with ResourceSampler() as sampler, ThreadPoolExecutor(users) as pool:
+                completed = sum(pool.map(user_loop, range(users)))
+
+            # Analysis polling and chat turns mostly wait on the completion; the rest is script time
+            reruns = [sample for name, samples in timer.samples.items() if name not in ("analysis", "chat_turn")
+                      for sample in samples]
+            step = {
+                "users": users,
+                "flows": completed,
+                "failed": len(failures),
+                "flows_per_minute": completed * 60 / sampler.wall_seconds,
+                "reruns": summarize(reruns),
+                "stages": {name: summarize(samples) for name, samples in timer.samples.items()},
+                "cpu_cores": sampler.cpu_seconds / sampler.wall_seconds,
+                "rss_peak_mb": max(sampler.rss) / 1e6,
+                "failures": failures[:10],
+            }
+            steps.append(step)
+
+            def stage_p95(name):
+                return step["stages"].get(name, summarize([]))["p95_ms"]
+
+            print(f"{users:>6} {completed:>6} {len(failures):>7} {step['flows_per_minute']:>10.1f} "
+                  f"{step['reruns']['p50_ms']:>13.1f} {step['reruns']['p95_ms']:>13.1f} "
+                  f"{step['reruns']['p99_ms']:>13.1f} {stage_p95('analysis') / 1000:>15.2f} "
+                  f"{stage_p95('chat_turn') / 1000:>11.2f} {step['cpu_cores']:>10.2f} {step['rss_peak_mb']:>8.0f}")
+        upstream = len(server.requests)
+
+    # A node is saturated once more users stop buying proportionally more throughput,
+    # or reruns get slow enough that the pages feel stuck
+    saturated = None
+    for previous, step in zip(steps, steps[1:]):
+        expected = previous["flows_per_minute"] * step["users"] / previous["users"]
+        if (step["flows_per_minute"] < previous["flows_per_minute"] + args.min_gain * (expected - previous["flows_per_minute"])
+                or step["reruns"]["p95_ms"] > args.max_rerun_p95_ms):
+            saturated = step["users"]
+            break
+    print(f"Upstream requests: {upstream} ({args.error_rate:.0%} injected errors), cores available: {os.cpu_count()}")
+    if saturated is not None:
+        print(f"Saturates at {saturated} concurrent users (throughput below {args.min_gain:.0%} of linear "
+              f"gain or rerun p95 above {args.max_rerun_p95_ms:.0f} ms)")
+    else:
+        print("No saturation within the tested range")
+    for step in steps:
+        for failure in step["failures"][:3]:
+            print(f"  {step['users']} users: {failure}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": time.time(),
+                "config": {key: value for key, value in vars(args).items() if key != "func"},
+                "steps": steps,
+                "saturated_at": saturated,
+            }, f, indent=2)
+        print(f"Saved results to {args.output}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+COLD_START_SCRIPT = """
+import sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("v4.py", default_timeout=120)
+at.secrets["general"] = {"OPENAI_API_KEY": "sk-mock"}
+if sys.argv[1] != "Login":
+    at.session_state["logged_in"] = True
+    at.session_state["username"] = "bench"
+    at.session_state["page"] = sys.argv[1]
+start = time.perf_counter()
+at.run()
+print(time.perf_counter() - start)
+"""
+
+
+def bench_reruns(args):
+    import subprocess
+    from streamlit.testing.v1 import AppTest
+
+    env = {**os.environ, "PYTHONPATH": os.getcwd()}
+    pages = ["Login", "Acne Analysis", "AI Dermatologist", "About Page", "FAQs"]
+    print(f"{'page':<20} {'cold start ms':>14} {'rerun p50 ms':>13} {'rerun p95 ms':>13}")
+    for page in pages:
+        cold = []
+        for _ in range(args.cold_runs):
+            output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT, page], env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            cold.append(float(output.strip().splitlines()[-1]))
+
+        sys.path.insert(0, os.getcwd())
+        at = AppTest.from_file("v4.py", default_timeout=120)
+        at.secrets["general"] = {"OPENAI_API_KEY": "sk-mock"}
+        if page != "Login":
+            at.session_state["logged_in"] = True
+            at.session_state["username"] = "bench"
+            at.session_state["page"] = page
+        at.run()
+        timer = StageTimer()
+        for _ in range(args.reruns):
+            timer.run(page, at)
+        reruns = summarize(timer.samples[page])
+        print(f"{page:<20} {statistics.median(cold) * 1000:>14.1f} {reruns['p50_ms']:>13.2f} {reruns['p95_ms']:>13.2f}")
+
+
+def compare_reports(baseline, report, tolerance):
+    regressions = []
+    stages = {**report["stages"], "total": report["total"]}
+    baseline_stages = {**baseline["stages"], "total": baseline["total"]}
+    for name, stats in stages.items():
+        before = baseline_stages.get(name)
+        if before and stats["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append((name, before["p95_ms"], stats["p95_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the acne detection app")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    credentials = subparsers.add_parser("credentials", help="Login latency against growing credential files")
+    credentials.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000, 1_000_000])
+    credentials.add_argument("--logins", type=int, default=10_000)
+    credentials.add_argument("--legacy-max", type=int, default=100_000,
+                             help="Largest user count to also time the old pandas scan for")
+    credentials.set_defaults(func=bench_credentials)
+
+    signup = subparsers.add_parser("signup", help="Concurrent sign-up cost and row loss against growing files")
+    signup.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    signup.add_argument("--workers", type=int, default=8, help="Parallel processes signing up at once")
+    signup.add_argument("--signups", type=int, default=200, help="Sign-ups per worker")
+    signup.set_defaults(func=bench_signup)
+
+    hashing = subparsers.add_parser("hashing", help="bcrypt logins per second per core at each cost factor")
+    hashing.add_argument("--rounds", type=int, nargs="+", default=[8, 10, 12, 14])
+    hashing.add_argument("--logins", type=int, default=20, help="Sequential verifications per cost factor")
+    hashing.add_argument("--workers", type=int, help="Verification pool size (default: one per core)")
+    hashing.add_argument("--sessions", type=int, default=64, help="Concurrent logins in the storm")
+    hashing.set_defaults(func=bench_hashing)
+
+    face_screen = subparsers.add_parser("face-screen", help="Precision/recall of the local non-face pre-screen")
+    face_screen.add_argument("--labeled", help="Folder with face/ and not_face/ subfolders (default: built-in set)")
+    face_screen.add_argument("--thresholds", type=float, nargs="+", default=[0.005, 0.01, 0.015, 0.02, 0.05, 0.1])
+    face_screen.add_argument("-v", "--verbose", action="store_true", help="List every image with its score")
+    face_screen.set_defaults(func=bench_face_screen)
+
+    images = subparsers.add_parser("images", help="Payload bytes and image tokens before/after preprocessing")
+    images.add_argument("images", nargs="*", default=FACE_SAMPLES + SAMPLE_IMAGES)
+    images.add_argument("--max-edge", type=int, default=1024)
+    images.add_argument("--format", default="JPEG", choices=["JPEG", "WEBP"])
+    images.add_argument("--quality", type=int, default=85)
+    images.add_argument("--model", default="gpt-4o-mini")
+    images.add_argument("--no-crop", action="store_true",
+                        help="Skip the face-region crop (measured here even though IMAGE_FACE_CROP is off by default)")
+    images.add_argument("--no-portraits", dest="portraits", action="store_false",
+                        help="Skip the synthetic portraits built from the face samples")
+    images.set_defaults(func=bench_images)
+
+    previews = subparsers.add_parser("previews", help="Image bytes sent to the browser per rerun, originals vs previews")
+    previews.add_argument("images", nargs="*", default=SAMPLE_IMAGES + FACE_SAMPLES)
+    previews.add_argument("--max-edge", type=int, default=800)
+    previews.add_argument("--reruns", type=int, default=5)
+    previews.add_argument("--bandwidth-kbps", type=int, default=400, help="Download speed of the simulated phone")
+    previews.add_argument("--rtt-ms", type=int, default=400)
+    previews.set_defaults(func=bench_previews)
+
+    chat = subparsers.add_parser("chat-history", help="Prompt tokens per turn over a long simulated chat")
+    chat.add_argument("--turns", type=int, default=200)
+    chat.add_argument("--budget", type=int, default=1500)
+    chat.add_argument("--response-words", type=int, default=60)
+    chat.add_argument("--slack", type=int, default=100, help="Prompt tokens allowed over the budget")
+    chat.set_defaults(func=bench_chat_history)
+
+    batch_check = subparsers.add_parser("batch-check", help="Pass/fail check of the batch CLI against the mock endpoint")
+    batch_check.add_argument("--images", type=int, default=12)
+    batch_check.add_argument("--concurrency", type=int, default=4)
+    batch_check.add_argument("--latency", type=float, default=0.2)
+    batch_check.set_defaults(func=check_batch)
+
+    batch = subparsers.add_parser("batch", help="Batch CLI throughput against the mock endpoint")
+    batch.add_argument("--images", type=int, default=64)
+    batch.add_argument("--latency", type=float, default=1.0, help="Mock seconds per completion")
+    batch.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    batch.set_defaults(func=bench_batch)
+
+    prompt_cache = subparsers.add_parser("prompt-cache", help="Provider prompt-cache hit rate and first-token latency")
+    prompt_cache.add_argument("--requests", type=int, default=20, help="Requests per registered prompt")
+    prompt_cache.add_argument("--latency", type=float, default=0.3, help="Mock seconds before the first token")
+    prompt_cache.add_argument("--cache-min-tokens", type=int, default=1024,
+                              help="Shortest prefix the mock caches; lower it to exercise the hit path")
+    prompt_cache.add_argument("--base-url", help="Measure a real endpoint instead of the mock")
+    prompt_cache.add_argument("--api-key")
+    prompt_cache.set_defaults(func=bench_prompt_cache)
+
+    structured = subparsers.add_parser("structured", help="Completion length and latency spread, free-form vs JSON schema")
+    structured.add_argument("--requests", type=int, default=30)
+    structured.add_argument("--image", default="uploaded_image.png")
+    structured.add_argument("--max-tokens", type=int, default=900)
+    structured.add_argument("--latency", type=float, default=0.3, help="Mock seconds before the first token")
+    structured.add_argument("--token-delay", type=float, default=0.01, help="Mock seconds per streamed token")
+    structured.add_argument("--response-words", type=int, default=450, help="Median mock free-form answer length")
+    structured.add_argument("--spread", type=float, default=0.5, help="Log-normal sigma of free-form lengths")
+    structured.add_argument("--base-url", help="Measure a real endpoint instead of the mock")
+    structured.add_argument("--api-key")
+    structured.set_defaults(func=bench_structured)
+
+    coalesce = subparsers.add_parser("coalesce", help="Upstream calls when many sessions analyze the same photos")
+    coalesce.add_argument("--sessions", type=int, default=20)
+    coalesce.add_argument("--photos", type=int, default=2, help="Distinct photos shared between the sessions")
+    coalesce.add_argument("--latency", type=float, default=2.0, help="Mock seconds before the first token")
+    coalesce.add_argument("--spread", type=float, default=1.0, help="Seconds over which the sessions submit")
+    coalesce.set_defaults(func=bench_coalesce)
+
+    history = subparsers.add_parser("history", help="Saved-analysis page reads and lookups as a user's history grows")
+    history.add_argument("--entries", type=int, nargs="+", default=[100, 1000, 10_000], help="Entries per user")
+    history.add_argument("--users", type=int, default=5, help="Users sharing the database")
+    history.add_argument("--page-size", type=int, default=10)
+    history.add_argument("--reads", type=int, default=500)
+    history.add_argument("--response-words", type=int, default=300)
+    history.add_argument("--image", default="uploaded_image.png")
+    history.set_defaults(func=bench_history)
+
+    question_cache = subparsers.add_parser("question-cache", help="Near-duplicate chat question hit rate and mistakes")
+    question_cache.add_argument("--questions", type=int, default=10_000, help="Distinct questions for the memory bound check")
+    question_cache.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9])
+    question_cache.add_argument("--max-entries", type=int, default=2000)
+    question_cache.set_defaults(func=bench_question_cache)
+
+    session_memory = subparsers.add_parser("session-memory", help="Per-session state held in memory vs spilled")
+    session_memory.add_argument("--sessions", type=int, nargs="+", default=[10, 100, 500])
+    session_memory.add_argument("--turns", type=int, default=100, help="Chat messages per session")
+    session_memory.add_argument("--session-budget", type=int, default=1024 * 1024)
+    session_memory.add_argument("--global-budget", type=int, default=32 * 1024 * 1024)
+    session_memory.set_defaults(func=bench_session_memory)
+
+    load = subparsers.add_parser("load", help="Concurrent simulated users ramped up until the node saturates")
+    load.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                      help="Concurrent users at each step of the ramp")
+    load.add_argument("--duration", type=float, default=30, help="Seconds each step runs for")
+    load.add_argument("--ramp-up", type=float, default=2, help="Seconds over which a step's users arrive")
+    load.add_argument("--images", nargs="*", default=SAMPLE_IMAGES + FACE_SAMPLES)
+    load.add_argument("--chat-turns", type=int, default=3)
+    load.add_argument("--latency", type=float, default=0.5, help="Mock seconds before the first token")
+    load.add_argument("--token-delay", type=float, default=0.005)
+    load.add_argument("--response-words", type=int, default=120)
+    load.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests answered with a 429")
+    load.add_argument("--poll", type=float, default=1.0, help="Seconds between reruns while an analysis runs")
+    load.add_argument("--bcrypt-rounds", type=int, default=12)
+    load.add_argument("--with-cache", action="store_true", help="Keep the analysis result cache enabled")
+    load.add_argument("--min-gain", type=float, default=0.5,
+                      help="Share of the linear throughput gain a step must reach to count as scaling")
+    load.add_argument("--max-rerun-p95-ms", type=float, default=1000)
+    load.add_argument("-o", "--output", help="Write the JSON report here")
+    load.set_defaults(func=bench_load)
+
+    e2e = subparsers.add_parser("e2e", help="Drive the app through AppTest against the mock endpoint")
+    e2e.add_argument("--iterations", type=int, default=5)
+    e2e.add_argument("--images", nargs="*", default=SAMPLE_IMAGES)
+    e2e.add_argument("--synthetic-kb", type=int, nargs="*", default=[100, 1024, 5 * 1024, 20 * 1024],
+                     help="Sizes of generated upload images in KB")
+    e2e.add_argument("--chat-turns", type=int, default=3)
+    e2e.add_argument("--latency", type=float, default=0.3, help="Mock seconds before the first token")
+    e2e.add_argument("--token-delay", type=float, default=0.005)
+    e2e.add_argument("--response-words", type=int, default=120)
+    e2e.add_argument("--with-cache", action="store_true", help="Keep the analysis result cache enabled")
+    e2e.add_argument("-o", "--output", help="Write the JSON report here")
+    e2e.add_argument("--compare", help="Earlier JSON report; exit 1 if any stage's p95 regressed")
+    e2e.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 slowdown before flagging")
+    e2e.set_defaults(func=bench_e2e)
+
+    reruns = subparsers.add_parser("reruns", help="Cold start and per-rerun script time for each page")
+    reruns.add_argument("--reruns", type=int, default=50)
+    reruns.add_argument("--cold-runs", type=int, default=3, help="Fresh processes per page for cold start")
+    reruns.set_defaults(func=bench_reruns)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+
+from llm_client import record_request_metrics, request_bytes, usage_to_dict
+from prompts import CHAT_SUMMARY
+from rate_limit import call_with_retry, settle_usage
+
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "250"))
+
+SUMMARY_PROMPT = CHAT_SUMMARY.text
+
+# Rough per-message overhead the chat format adds on top of the content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text; close enough for budgeting without tiktoken
+    return len(text) // 4 + 1
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def messages_tokens(messages):
+    return sum(message_tokens(message) for message in messages)
+
+
+def create_summarizer(client, model):
+    def summarize(previous_summary, messages):
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        request = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Current summary:\n{previous_summary or '(empty)'}\n\nNew turns:\n{transcript}"},
+            ],
+            "temperature": 0,
+            "max_tokens": CHAT_SUMMARY_MAX_TOKENS,
+        }
+        response, stats, estimated = call_with_retry(client.chat.completions.create, request)
+        settle_usage(estimated, response.usage)
+        record_request_metrics(name="chat_summary", model=model, prompt=CHAT_SUMMARY.tag, queued_time=stats.queued_time,
+                               attempts=stats.attempts, request_bytes=request_bytes(request),
+                               **usage_to_dict(response.usage))
+        return response.choices[0].message.content
+
+    return summarize
+
+
+class ChatHistory:
+    # Builds the prompt for the next turn from the full message list kept for display.
+    # Recent turns are sent verbatim; once they exceed the token budget, the oldest are
+    # folded into a rolling summary until the verbatim window is back under half the
+    # budget, so summarization runs every few turns rather than on every one.
+
+    def __init__(self, state, summarize, token_budget=CHAT_HISTORY_TOKEN_BUDGET):
+        # state is any dict that persists between turns, e.g. a st.session_state entry
+        self.state = state
+        self.state.setdefault("summary", "")
+        self.state.setdefault("summarized_count", 0)
+        self.summarize = summarize
+        self.token_budget = token_budget
+
+    def _fold(self, messages):
+        if self.state["summarized_count"] > len(messages):
+            self.state["summary"] = ""
+            self.state["summarized_count"] = 0
+        start = self.state["summarized_count"]
+        window = messages[start:]
+        if messages_tokens(window) + estimate_tokens(self.state["summary"]) <= self.token_budget:
+            return
+
+        # Keep the newest turns that fit in half the budget, always including the last message
+        kept = message_tokens(window[-1])
+        cut = len(messages) - 1
+        while cut > start and kept + message_tokens(messages[cut - 1]) <= self.token_budget // 2:
+            cut -= 1
+            kept += message_tokens(messages[cut])
+        # Start the verbatim window on a user turn so it never opens with a dangling answer
+        while cut < len(messages) - 1 and messages[cut]["role"] != "user":
+            cut += 1
+        if cut <= start:
+            return
+
+        self.state["summary"] = self.summarize(self.state["summary"], messages[start:cut])
+        self.state["summarized_count"] = cut
+
+    def build_messages(self, system_prompt, messages):
+        self._fold(messages)
+        prompt = [{"role": "system", "content": system_prompt}]
+        if self.state["summary"]:
+            prompt.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.state['summary']}"})
+        prompt.extend(messages[self.state["summarized_count"]:])
+        return prompt
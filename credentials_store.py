@@ -0,0 +1,204 @@
+import csv
+import io
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CREDENTIAL_FIELDS = ["username", "email", "password", "security_question", "security_answer"]
+
+# Rewrite the file once this many rows have been superseded by later appends
+COMPACT_AFTER_SUPERSEDED_ROWS = int(os.getenv("CREDENTIALS_COMPACT_AFTER", "1000"))
+
+
+class _Index:
+    # username/email lookups over the rows parsed so far, and where parsing stopped
+    def __init__(self):
+        self.offset = 0
+        self.header = None
+        self.superseded = 0
+        self.by_username = {}
+        self.by_email = {}
+
+    def add(self, user):
+        previous = self.by_username.get(user["username"])
+        if previous is not None:
+            self.superseded += 1
+            same_email = self.by_email.get(previous["email"], [])
+            if previous in same_email:
+                same_email.remove(previous)
+        self.by_username[user["username"]] = user
+        self.by_email.setdefault(user["email"], []).append(user)
+
+    def read_new_rows(self, path):
+        with open(path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        # Only consume complete lines; a concurrent append may still be in progress
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return
+        self.offset += end
+        rows = csv.reader(io.StringIO(data[:end].decode("utf-8")))
+        for row in rows:
+            if not row:
+                continue
+            if self.header is None:
+                self.header = row
+                continue
+            record = dict(zip(self.header, row))
+            self.add({field: record.get(field) or "" for field in CREDENTIAL_FIELDS})
+
+
+class CredentialStore:
+    # The CSV is treated as an append-only log: sign-ups and updates append a row,
+    # and the last row for a username wins. Lookups are served from in-memory
+    # username/email indexes. The file's (inode, mtime, size) signature is checked on
+    # every lookup; appended bytes are parsed incrementally and a full reload only
+    # happens when the file was replaced (e.g. by compaction) or truncated. A reload is
+    # built off to the side and swapped in whole, so lookups never see a half-built index.
+
+    def __init__(self, path, compact_after=COMPACT_AFTER_SUPERSEDED_ROWS):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._signature = None
+        self._index = _Index()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _file_lock(self):
+        with self._write_lock, open(self.lock_path, "a+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def refresh(self, force=False):
+        signature = self._file_signature()
+        if not force and signature == self._signature:
+            return
+        with self._lock:
+            if not force and signature == self._signature:
+                return
+            previous = self._signature
+            if signature is None:
+                self._index = _Index()
+            elif force or previous is None or previous[0] != signature[0] or signature[2] < self._index.offset:
+                index = _Index()
+                index.read_new_rows(self.path)
+                self._index = index
+            else:
+                self._index.read_new_rows(self.path)
+            self._signature = signature
+
+    def __len__(self):
+        self.refresh()
+        return len(self._index.by_username)
+
+    def get_user(self, username):
+        self.refresh()
+        return self._index.by_username.get(username)
+
+    def get_users_by_email(self, email):
+        self.refresh()
+        return self._index.by_email.get(email, [])
+
+    def username_exists(self, username):
+        return self.get_user(username) is not None
+
+    def find_user_for_recovery(self, email, security_answer):
+        for user in self.get_users_by_email(email):
+            if user["security_answer"] == security_answer:
+                return user
+        return None
+
+    def _append_row(self, user):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        with open(self.path, "a+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                writer.writerow(CREDENTIAL_FIELDS)
+            else:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    buffer.write("\n")
+            writer.writerow([user[field] for field in CREDENTIAL_FIELDS])
+            f.write(buffer.getvalue().encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add_user(self, username, email, password, security_question, security_answer):
+        # Returns False instead of writing when the username is already taken
+        user = {
+            "username": username, "email": email, "password": password,
+            "security_question": security_question, "security_answer": security_answer,
+        }
+        with self._file_lock():
+            self.refresh()
+            if username in self._index.by_username:
+                return False
+            self._append_row(user)
+        self.refresh()
+        self._maybe_compact()
+        return True
+
+    def update_user(self, username, **changes):
+        with self._file_lock():
+            self.refresh()
+            current = self._index.by_username.get(username)
+            if current is None:
+                return False
+            self._append_row({**current, **changes})
+        self.refresh()
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self):
+        if self.compact_after and self._index.superseded >= self.compact_after:
+            self.compact()
+
+    def compact(self):
+        # Rewrites the file with only the live row per username, atomically replacing it.
+        # The index is caught up with appends first and rebuilt from the rows written, so
+        # the file is never parsed in full.
+        with self._file_lock():
+            self.refresh()
+            tmp_path = self.path + ".tmp"
+            compacted = _Index()
+            compacted.header = CREDENTIAL_FIELDS
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f, lineterminator="\n")
+                writer.writerow(CREDENTIAL_FIELDS)
+                for user in list(self._index.by_username.values()):
+                    writer.writerow([user[field] for field in CREDENTIAL_FIELDS])
+                    compacted.add(user)
+                f.flush()
+                os.fsync(f.fileno())
+            compacted.offset = os.path.getsize(tmp_path)
+            with self._lock:
+                os.replace(tmp_path, self.path)
+                self._index, self._signature = compacted, self._file_signature()
@@ -0,0 +1,115 @@
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from image_utils import load_image
+
+# Cheap local check run before the paid vision call. It scores how much of the image
+# looks like photographed skin: skin-tone pixels (YCbCr and RGB rules) that also carry
+# the fine texture a camera sensor produces, which flat graphics, screenshots, logos
+# and blank images lack. Close-ups of a cheek count as faces here; so would a hand,
+# which is an accepted false positive.
+
+FACE_SCREEN_ENABLED = os.getenv("FACE_SCREEN", "1") == "1"
+# Scores below this skip the API call; lower it if real photos get rejected
+FACE_SCREEN_THRESHOLD = float(os.getenv("FACE_SCREEN_THRESHOLD", "0.01"))
+# Share of the skin-coloured pixels that must carry photographic texture; below it the
+# image is treated as a graphic (e.g. a logo's peach shapes) and scores 0
+FACE_SCREEN_MIN_TEXTURE = float(os.getenv("FACE_SCREEN_MIN_TEXTURE", "0.4"))
+SCREEN_EDGE = 128
+# Face-region cropping: extra border around the skin region, as a fraction of its size,
+# and the largest crop (share of the image area) still worth applying
+FACE_CROP_MARGIN = float(os.getenv("FACE_CROP_MARGIN", "0.15"))
+FACE_CROP_MAX_AREA = float(os.getenv("FACE_CROP_MAX_AREA", "0.8"))
+
+
+@dataclass
+class ScreenResult:
+    score: float
+    skin_fraction: float
+    textured_fraction: float
+    threshold: float
+    elapsed: float
+
+    @property
+    def passed(self):
+        return self.score >= self.threshold
+
+
+def skin_mask(rgb):
+    r, g, b = (rgb[..., i].astype(np.int16) for i in range(3))
+    y = 0.299 * r + 0.587 * g + 0.114 * b
+    cb = 128 - 0.168736 * r - 0.331264 * g + 0.5 * b
+    cr = 128 + 0.5 * r - 0.418688 * g - 0.081312 * b
+    # Brightness floors low enough for deep skin tones in ordinary indoor light
+    ycbcr = (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173) & (y > 20)
+    # Red dominant and not grey: rules out the beige and pale blue tones YCbCr lets through
+    rgb_rule = (r > 30) & (r > g) & (r > b) & (r - np.minimum(g, b) > 12)
+    return ycbcr & rgb_rule
+
+
+def texture_mask(rgb):
+    # Photographs have small pixel-to-pixel variation everywhere; rendered graphics
+    # have large areas where neighbouring pixels are (nearly) identical. Darker pixels
+    # vary less in absolute terms, so the bar scales with brightness, down to half.
+    grey = rgb.astype(np.float32).mean(axis=2)
+    dx = np.abs(np.diff(grey, axis=1))[:-1, :]
+    dy = np.abs(np.diff(grey, axis=0))[:, :-1]
+    variation = dx + dy
+    textured = (variation > 1.5 * np.clip(grey[:-1, :-1], 64, 128) / 128) & (variation < 60)
+    return np.pad(textured, ((0, 1), (0, 1)))
+
+
+def screen_rgb(image, threshold=FACE_SCREEN_THRESHOLD, min_texture=FACE_SCREEN_MIN_TEXTURE):
+    start = time.perf_counter()
+    if max(image.size) > SCREEN_EDGE:
+        image = image.copy()
+        image.thumbnail((SCREEN_EDGE, SCREEN_EDGE), Image.BILINEAR)
+    rgb = np.asarray(image.convert("RGB"))
+    skin = skin_mask(rgb)
+    textured_skin = skin & texture_mask(rgb)
+    skin_fraction = float(skin.mean())
+    textured_fraction = float(textured_skin.sum() / max(skin.sum(), 1))
+    score = skin_fraction * textured_fraction if textured_fraction >= min_texture else 0.0
+    return ScreenResult(score, skin_fraction, textured_fraction, threshold, time.perf_counter() - start)
+
+
+def screen_image(image_bytes, threshold=FACE_SCREEN_THRESHOLD):
+    # Decodes at reduced size (JPEG draft mode), so large uploads screen in milliseconds
+    start = time.perf_counter()
+    result = screen_rgb(load_image(image_bytes, SCREEN_EDGE * 2), threshold)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def face_region(image, margin=FACE_CROP_MARGIN, max_area=FACE_CROP_MAX_AREA):
+    # Box (left, top, right, bottom) in image coordinates around the textured skin,
+    # or None when cropping would keep most of the image anyway. This is not a face
+    # detector: any skin-coloured region in shot (a hand, the neck, an arm, a peach
+    # backdrop) sets the box just as a face does, so it can only widen around the face
+    # or land on something else entirely.
+    thumbnail = image.copy()
+    thumbnail.thumbnail((SCREEN_EDGE, SCREEN_EDGE), Image.BILINEAR)
+    rgb = np.asarray(thumbnail.convert("RGB"))
+    skin = skin_mask(rgb) & texture_mask(rgb)
+    rows, cols = np.nonzero(skin)
+    if len(rows) < 0.01 * skin.size:
+        return None
+    # Percentiles rather than min/max so stray skin-coloured pixels don't stretch the box
+    top, bottom = np.percentile(rows, [2, 98])
+    left, right = np.percentile(cols, [2, 98])
+    pad_y, pad_x = (bottom - top + 1) * margin, (right - left + 1) * margin
+    scale_x, scale_y = image.width / rgb.shape[1], image.height / rgb.shape[0]
+    box = (
+        max(0, int((left - pad_x) * scale_x)),
+        max(0, int((top - pad_y) * scale_y)),
+        min(image.width, int((right + 1 + pad_x) * scale_x)),
+        min(image.height, int((bottom + 1 + pad_y) * scale_y)),
+    )
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if area > max_area * image.width * image.height:
+        return None
+    return box
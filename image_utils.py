@@ -0,0 +1,222 @@
+import base64
+import io
+import math
+import os
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+# "low", "high", or "auto" to pick from the final image size
+IMAGE_DETAIL = os.getenv("IMAGE_DETAIL", "auto")
+# Crop to the skin region before resizing so lesions keep their resolution. Off by default:
+# the region is found by skin colour, not by a face detector, so a hand or neck in shot can
+# take the crop away from the face
+IMAGE_FACE_CROP = os.getenv("IMAGE_FACE_CROP", "0") == "1"
+# Longest edge of the renditions shown in the browser (the centered layout is ~700px wide,
+# so this covers high-DPI phones); 0 sends the original files instead
+PREVIEW_MAX_EDGE = int(os.getenv("PREVIEW_MAX_EDGE", "800"))
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "80"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+ORIENTATION_TAG = 0x0112
+GPS_INFO_TAG = 0x8825
+
+# (base tokens, tokens per 512px tile) per model, as published in the vision pricing docs
+IMAGE_TOKEN_COSTS = {
+    "gpt-4o-mini": (2833, 5667),
+    "gpt-4o": (85, 170),
+}
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    detail: str
+    original_size: int
+    original_width: int
+    original_height: int
+    # Share of the original area kept by the face crop (1.0 when not cropped), and the
+    # encoded size and 512px tile count the same image would have had without cropping
+    crop_ratio: float = 1.0
+    uncropped_size: int = None
+    uncropped_tiles: int = None
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def bytes_saved(self):
+        return max(0, self.uncropped_size - self.size) if self.uncropped_size else 0
+
+    @property
+    def tiles(self):
+        return image_tiles(self.width, self.height, self.detail)
+
+    @property
+    def tiles_saved(self):
+        return max(0, self.uncropped_tiles - self.tiles) if self.uncropped_tiles is not None else 0
+
+    @property
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{encode_image(self.data)}"
+
+    def estimated_tokens(self, model="gpt-4o"):
+        return estimate_image_tokens(self.width, self.height, self.detail, model)
+
+    def original_estimated_tokens(self, model="gpt-4o"):
+        return estimate_image_tokens(self.original_width, self.original_height, "high", model)
+
+
+def encode_image(image_bytes):
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+
+def image_tiles(width, height, detail):
+    # 512px tiles billed on top of the base cost; low detail is billed the base cost only
+    if detail == "low":
+        return 0
+    # High detail: fit within 2048x2048, scale the shortest side down to 768, count 512px tiles
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def estimate_image_tokens(width, height, detail, model="gpt-4o"):
+    base, per_tile = IMAGE_TOKEN_COSTS.get(model, IMAGE_TOKEN_COSTS["gpt-4o"])
+    return base + per_tile * image_tiles(width, height, detail)
+
+
+def resolve_detail(size, detail):
+    # "auto" sends small images at low detail
+    if detail == "auto":
+        return "low" if max(size) <= 512 else "high"
+    return detail
+
+
+def estimate_image_url_tokens(url, detail="auto", model="gpt-4o"):
+    # Token cost of an image_url message part. Data URLs are measured from the image
+    # header; remote URLs are assumed to be as large as high detail allows
+    width = height = 2048
+    if url.startswith("data:"):
+        width, height = Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))).size
+    return estimate_image_tokens(width, height, resolve_detail((width, height), detail), model)
+
+
+def load_image(image_bytes, max_edge=None):
+    image = Image.open(io.BytesIO(image_bytes))
+    if max_edge is not None:
+        # Let the JPEG decoder downscale by a power of two while decoding
+        image.draft("RGB", (max_edge, max_edge))
+    # Apply the EXIF orientation before the metadata is dropped on re-encode
+    image = ImageOps.exif_transpose(image)
+    return image.convert("RGB")
+
+
+def encode_rgb_image(image, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+def _fit(image, max_edge):
+    if max(image.size) > max_edge:
+        image = image.copy()
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return image
+
+
+def crop_to_face(image_bytes, image, max_edge):
+    # Returns the cropped image and the kept share of the area, or (image, 1.0)
+    from face_screen import face_region
+
+    box = face_region(image)
+    if box is None:
+        return image, 1.0
+    crop_ratio = (box[2] - box[0]) * (box[3] - box[1]) / (image.width * image.height)
+    crop_edge = max(box[2] - box[0], box[3] - box[1])
+    if crop_edge < max_edge:
+        # The draft decode may have been too small for the crop; decode at the size the
+        # crop needs to fill max_edge (capped by the original), then map the box over
+        scale = max_edge / crop_edge
+        larger = load_image(image_bytes, int(max(image.size) * scale))
+        if larger.width > image.width:
+            factor = larger.width / image.width
+            box = tuple(int(value * factor) for value in box)
+            image = larger
+    return image.crop(box), crop_ratio
+
+
+def _sendable_as_is(image):
+    # A format the API accepts, already upright, and without location metadata
+    exif = image.getexif()
+    return (image.format in MIME_TYPES and exif.get(ORIENTATION_TAG, 1) == 1
+            and GPS_INFO_TAG not in exif)
+
+
+def prepare_image(image_bytes, max_edge=IMAGE_MAX_EDGE, image_format=IMAGE_FORMAT,
+                  quality=IMAGE_QUALITY, detail=IMAGE_DETAIL, crop=IMAGE_FACE_CROP):
+    # Optionally crop to the face, downscale to max_edge, re-encode without metadata and
+    # label the MIME type correctly. An upload that needed no crop or resize is sent as-is
+    # when re-encoding would not make it smaller.
+    source = Image.open(io.BytesIO(image_bytes))
+    original_width, original_height = source.size
+    image = load_image(image_bytes, max_edge)
+    crop_ratio, uncropped_size, uncropped_tiles = 1.0, None, None
+    if crop:
+        cropped, crop_ratio = crop_to_face(image_bytes, image, max_edge)
+        if crop_ratio < 1.0:
+            uncropped = _fit(image, max_edge)
+            uncropped_size = len(encode_rgb_image(uncropped, image_format, quality))
+            uncropped_tiles = image_tiles(*uncropped.size, resolve_detail(uncropped.size, detail))
+            image = cropped
+    image = _fit(image, max_edge)
+    detail = resolve_detail(image.size, detail)
+    data, mime_type = encode_rgb_image(image, image_format, quality), MIME_TYPES[image_format]
+    if (crop_ratio == 1.0 and image.size == source.size and len(data) >= len(image_bytes)
+            and _sendable_as_is(source)):
+        data, mime_type = image_bytes, MIME_TYPES[source.format]
+    return PreparedImage(
+        data=data,
+        mime_type=mime_type,
+        width=image.width,
+        height=image.height,
+        detail=detail,
+        original_size=len(image_bytes),
+        original_width=original_width,
+        original_height=original_height,
+        crop_ratio=crop_ratio,
+        uncropped_size=uncropped_size,
+        uncropped_tiles=uncropped_tiles,
+    )
+
+
+def make_thumbnail(image_bytes, max_edge=128, quality=70):
+    # Small JPEG kept with saved results in place of the full image
+    return encode_rgb_image(_fit(load_image(image_bytes, max_edge), max_edge), "JPEG", quality)
+
+
+def make_preview(image_bytes, max_edge=PREVIEW_MAX_EDGE, quality=PREVIEW_QUALITY):
+    # Display-sized JPEG for st.image, or the original when that is already smaller
+    if not max_edge:
+        return image_bytes
+    preview = encode_rgb_image(_fit(load_image(image_bytes, max_edge), max_edge), "JPEG", quality)
+    return preview if len(preview) < len(image_bytes) else image_bytes
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
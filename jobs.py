@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Process-wide background job queue. Pages submit work and keep only the job id in
+# st.session_state, so reruns, widget interactions and reconnects never cancel or
+# lose an in-flight call; a later rerun picks the finished result up by id.
+# Jobs submitted with a key are coalesced: while one with the same key is queued or
+# running, later submissions get that job back instead of starting another.
+# on_done(job) callbacks run on the worker once the job finishes, one per submission,
+# including the ones coalesced onto it.
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "8"))
+# Finished jobs are kept this long for their sessions to collect them
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+
+
+class Job:
+    def __init__(self, kind, owner=None, key=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.key = key
+        # Submissions that were coalesced onto this job
+        self.joined = 0
+        self.status = "queued"
+        # Partial output and the latest notice (e.g. rate-limit waits) while running
+        self.text = ""
+        self.notice = None
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # None once the job has finished and its callbacks have been taken
+        self.callbacks = []
+
+    @property
+    def done(self):
+        return self.status in ("done", "error")
+
+    @property
+    def wait_time(self):
+        return (self.started or time.time()) - self.submitted
+
+    @property
+    def run_time(self):
+        return (self.finished or time.time()) - self.started if self.started else 0.0
+
+
+class JobQueue:
+    def __init__(self, workers=ANALYSIS_WORKERS, result_ttl=JOB_RESULT_TTL):
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis-job")
+        self._jobs = {}
+        self._in_flight = {}
+        self._coalesced = 0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._busy_seconds = 0.0
+
+    def submit(self, fn, kind="analysis", owner=None, key=None, on_done=None):
+        # fn(job) runs on a worker; its return value becomes job.result, and any
+        # exception is stored as job.error rather than raised into a script thread
+        with self._lock:
+            self._prune()
+            job = self._in_flight.get(key) if key is not None else None
+            if job is not None:
+                job.joined += 1
+                self._coalesced += 1
+                metrics.increment("upstream_calls_coalesced", kind=kind)
+                if on_done is not None:
+                    job.callbacks.append(on_done)
+                return job
+            job = Job(kind, owner, key)
+            if on_done is not None:
+                job.callbacks.append(on_done)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._in_flight[key] = job
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        job.started = time.time()
+        job.status = "running"
+        start = time.monotonic()
+        try:
+            job.result = fn(job)
+            job.status = "done"
+        except Exception as exc:
+            job.error = exc
+            job.status = "error"
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._busy_seconds += time.monotonic() - start
+                if self._in_flight.get(job.key) is job:
+                    del self._in_flight[job.key]
+                callbacks, job.callbacks = job.callbacks, None
+            for callback in callbacks:
+                try:
+                    callback(job)
+                except Exception:
+                    metrics.increment("job_callback_errors", kind=job.kind)
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id in [job.id for job in self._jobs.values() if job.done and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        # 1-based place among queued jobs, 0 once running
+        if job.status != "queued":
+            return 0
+        with self._lock:
+            queued = [other for other in self._jobs.values() if other.status == "queued"]
+        return sum(1 for other in queued if other.submitted <= job.submitted)
+
+    def jobs(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.submitted, reverse=True)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            busy = self._busy_seconds
+        running = [job for job in jobs if job.status == "running"]
+        busy += sum(job.run_time for job in running)
+        uptime = time.monotonic() - self._started
+        return {
+            "workers": self.workers,
+            "queued": sum(1 for job in jobs if job.status == "queued"),
+            "running": len(running),
+            "done": sum(1 for job in jobs if job.status == "done"),
+            "failed": sum(1 for job in jobs if job.status == "error"),
+            "coalesced": self._coalesced,
+            "utilization": len(running) / self.workers,
+            "average_utilization": busy / (self.workers * uptime) if uptime else 0.0,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
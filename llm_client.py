@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import time
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+import metrics
+from prompts import prompt_tag
+from rate_limit import call_with_retry, settle_usage
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "0") == "1"
+
+def record_request_metrics(**record):
+    record.setdefault("time", time.time())
+    name = record["name"]
+    metrics.increment("requests", name=name, status="ok")
+    if record.get("total_time") is not None:
+        metrics.observe("request_duration_seconds", record["total_time"], name=name, phase="total")
+    if record.get("time_to_first_token") is not None:
+        metrics.observe("request_duration_seconds", record["time_to_first_token"], name=name, phase="first_token")
+    for kind in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+        if record.get(kind):
+            metrics.increment("tokens", record[kind], name=name, kind=kind.removesuffix("_tokens"))
+    if record.get("request_bytes"):
+        metrics.increment("payload_bytes", record["request_bytes"], name=name)
+    if record.get("prompt_tokens"):
+        # Provider-side prefix cache: a hit means prompt_tokens_details.cached_tokens > 0
+        result = "hit" if record.get("cached_tokens") else "miss"
+        metrics.increment("prompt_cache_requests", name=name, prompt=record.get("prompt", "unregistered"), result=result)
+        if record.get("time_to_first_token") is not None:
+            metrics.observe("prompt_cache_first_token_seconds", record["time_to_first_token"], name=name,
+                            result=result)
+    metrics.log_event("request", **record)
+
+
+def record_request_error(name, exc):
+    metrics.increment("requests", name=name, status="error")
+    metrics.log_event("request_error", name=name, error=f"{type(exc).__name__}: {exc}")
+
+
+def request_bytes(request):
+    return len(json.dumps(request, default=str).encode("utf-8"))
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client(max_connections=OPENAI_MAX_CONNECTIONS,
+                       max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                       keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY, timeout=OPENAI_TIMEOUT,
+                       connect_timeout=OPENAI_CONNECT_TIMEOUT, http2=OPENAI_HTTP2, client_class=httpx.Client):
+    if http2 and not http2_available():
+        logger.warning("OPENAI_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1")
+        http2 = False
+    return client_class(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        http2=http2,
+    )
+
+
+def create_openai_client(api_key, base_url=None, **http_options):
+    # Build once per process and share it: every session then reuses the same
+    # keep-alive connections instead of paying for new TLS handshakes. Retries are
+    # handled by rate_limit so they share the process-wide quota buckets.
+    return OpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                  http_client=create_http_client(**http_options))
+
+
+def create_async_openai_client(api_key, base_url=None, **http_options):
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                       http_client=create_http_client(client_class=httpx.AsyncClient, **http_options))
+
+
+def pool_stats(client):
+    # httpx doesn't expose its connection pool publicly, so read httpcore's state defensively
+    http_client = getattr(client, "_client", client)
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    if pool is None:
+        return {}
+    connections = list(pool.connections)
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "queued_requests": sum(1 for request in list(pool._requests) if request.is_queued()),
+        "max_connections": pool._max_connections,
+        "max_keepalive_connections": pool._max_keepalive_connections,
+    }
+
+
+def usage_to_dict(usage):
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+    }
+
+
+class CompletionStream:
+    # Iterating yields text deltas (suitable for st.write_stream); once exhausted,
+    # text, usage, finish_reason, time_to_first_token, total_time and queued_time hold
+    # the final values.
+    # on_wait(seconds, reason) is called before any rate-limit or retry sleep.
+
+    def __init__(self, client, name, on_wait=None, **request):
+        self.client = client
+        self.name = name
+        self.on_wait = on_wait
+        self.request = request
+        self.text = ""
+        self.usage = None
+        self.finish_reason = None
+        self.time_to_first_token = None
+        self.total_time = None
+        self.queued_time = 0.0
+        self.attempts = 0
+
+    def __iter__(self):
+        start = time.perf_counter()
+        try:
+            stream, stats, estimated = call_with_retry(
+                self.client.chat.completions.create,
+                {**self.request, "stream": True, "stream_options": {"include_usage": True}},
+                on_wait=self.on_wait,
+            )
+        except Exception as exc:
+            record_request_error(self.name, exc)
+            raise
+        self.queued_time = stats.queued_time
+        self.attempts = stats.attempts
+        parts = []
+        for chunk in stream:
+            if chunk.usage is not None:
+                self.usage = chunk.usage
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].finish_reason:
+                self.finish_reason = chunk.choices[0].finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - start
+                parts.append(delta)
+                yield delta
+        self.total_time = time.perf_counter() - start
+        self.text = "".join(parts)
+        settle_usage(estimated, self.usage)
+        record_request_metrics(
+            name=self.name,
+            model=self.request.get("model"),
+            prompt=prompt_tag(self.request),
+            time_to_first_token=self.time_to_first_token,
+            total_time=self.total_time,
+            queued_time=self.queued_time,
+            attempts=self.attempts,
+            request_bytes=request_bytes(self.request),
+            **usage_to_dict(self.usage),
+        )
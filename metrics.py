@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lightweight in-process instrumentation: stage timing spans, counters, an OpenMetrics
+# text endpoint, optional JSON log lines, and a sampling profiler for script runs.
+
+METRICS_PREFIX = "acne"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_JSON_LOG = os.getenv("METRICS_JSON_LOG", "0") == "1"
+# Fraction of Streamlit script runs to profile (0 disables the profiler)
+PROFILE_SCRIPT_RUNS = float(os.getenv("PROFILE_SCRIPT_RUNS", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "script_runs.folded")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger("acne_metrics")
+if METRICS_JSON_LOG and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_help = {}
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+
+def _key(metric, labels):
+    return metric, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def describe(metric, help_text):
+    _help[metric] = help_text
+
+
+def observe(metric, value, buckets=LATENCY_BUCKETS, **labels):
+    key = _key(metric, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+def increment(metric, value=1, **labels):
+    key = _key(metric, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def log_event(event, **fields):
+    if METRICS_JSON_LOG:
+        logger.info(json.dumps({"event": event, "time": time.time(), **fields}, default=str))
+
+
+@contextmanager
+def span(stage, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("stage_duration_seconds", elapsed, stage=stage, **labels)
+        log_event("span", stage=stage, duration=elapsed, **labels)
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_openmetrics():
+    with _lock:
+        histograms = {key: (list(h.buckets), list(h.bucket_counts), h.count, h.sum) for key, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for family in sorted({name for name, _ in histograms}):
+        metric = f"{METRICS_PREFIX}_{family}"
+        lines.append(f"# TYPE {metric} histogram")
+        if family in _help:
+            lines.append(f"# HELP {metric} {_help[family]}")
+        for (name, labels), (buckets, bucket_counts, count, total) in sorted(histograms.items()):
+            if name != family:
+                continue
+            for bound, bucket_count in zip(buckets, bucket_counts):
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {bucket_count}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+    for family in sorted({name for name, _ in counters}):
+        metric = f"{METRICS_PREFIX}_{family}"
+        lines.append(f"# TYPE {metric} counter")
+        if family in _help:
+            lines.append(f"# HELP {metric} {_help[family]}")
+        for (name, labels), value in sorted(counters.items()):
+            if name == family:
+                lines.append(f"{metric}_total{_format_labels(labels)} {value}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    with _lock:
+        return {
+            "histograms": [{"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum}
+                           for (name, labels), h in _histograms.items()],
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in _counters.items()],
+        }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(snapshot()).encode(), "application/json"
+        elif self.path.startswith("/metrics"):
+            body = render_openmetrics().encode()
+            content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
+
+
+class SamplingProfiler:
+    # Samples one thread's Python stack every `interval` seconds from a background
+    # thread and counts collapsed stacks ("a;b;c 12"), the input format for
+    # flamegraph.pl and speedscope.
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="script-profiler")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_folded(self, path):
+        with _lock, open(path, "a", encoding="utf-8") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile_script_run(sample_rate=PROFILE_SCRIPT_RUNS, output=PROFILE_OUTPUT):
+    # Wrap a Streamlit script run; a sample_rate fraction of runs are profiled
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        yield
+        return
+    profiler = SamplingProfiler(threading.get_ident()).start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        profiler.write_folded(output)
+
+
+describe("stage_duration_seconds", "Wall time of each instrumented stage.")
+describe("request_duration_seconds", "Upstream completion time, total and to the first token.")
+describe("tokens", "Tokens reported by response.usage.")
+describe("payload_bytes", "Bytes sent upstream in request bodies.")
+describe("requests", "Upstream completion requests.")
+describe("image_crop_ratio", "Share of the upload's area kept by the face-region crop.")
+describe("image_bytes_saved", "Encoded image bytes not sent upstream thanks to the face-region crop.")
+describe("image_tiles_saved", "512px image tiles not billed thanks to the face-region crop.")
+describe("upstream_calls_coalesced", "Requests that joined an identical in-flight job instead of calling upstream.")
+describe("question_cache", "First-turn chat questions answered from a similar earlier one (hit) or not (miss).")
+describe("session_state_spills", "Per-session values written to disk to stay within the memory budgets.")
+describe("session_state_reloads", "Spilled per-session values loaded back from disk.")
+describe("face_screen", "Analyses by local pre-screen outcome: passed, rejected or overridden by the user.")
+describe("prompt_cache_requests", "Upstream requests by provider prompt-cache hit or miss.")
+describe("prompt_cache_first_token_seconds", "Time to first token split by provider prompt-cache hit or miss.")
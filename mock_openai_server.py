@@ -0,0 +1,267 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the chat completions endpoint, used by benchmark.py. Point a
+# client at it with base_url=server.base_url (or OPENAI_BASE_URL for the app).
+
+SAMPLE_WORDS = (
+    "Mild comedonal acne is visible on the forehead with a few inflamed papules on the cheeks. "
+    "Stage: mild to moderate. Cleanse twice daily with a gentle salicylic acid cleanser, apply "
+    "benzoyl peroxide 2.5% to active spots, use a non-comedogenic moisturizer and sunscreen, "
+    "drink enough water and avoid touching or picking the lesions."
+).split()
+
+
+def estimate_prompt_tokens(messages):
+    tokens = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += len(content) // 4 + 4
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(part["text"]) // 4
+            else:
+                tokens += 85
+        tokens += 4
+    return tokens
+
+
+def cached_prefix_tokens(messages, seen_prefixes, min_tokens):
+    # Mimics automatic prefix caching: leading system messages seen before count as
+    # cached, rounded down to 128-token blocks, once the prefix reaches min_tokens
+    prefix = []
+    for message in messages:
+        if message.get("role") != "system" or not isinstance(message.get("content"), str):
+            break
+        prefix.append(message)
+    tokens = estimate_prompt_tokens(prefix)
+    key = json.dumps(prefix, sort_keys=True)
+    hit = key in seen_prefixes
+    seen_prefixes.add(key)
+    if not hit or tokens < min_tokens:
+        return 0
+    return tokens // 128 * 128
+
+
+def sample_from_schema(schema, rng, defs=None):
+    # Smallest plausible value matching a JSON schema, for response_format=json_schema requests
+    defs = schema.get("$defs", {}) if defs is None else defs
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], rng, defs)
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        return sample_from_schema(options[0], rng, defs) if options else None
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: sample_from_schema(prop, rng, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), rng, defs) for _ in range(2)]
+    if kind == "boolean":
+        return True
+    if kind in ("integer", "number"):
+        return 1
+    start = rng.randrange(len(SAMPLE_WORDS))
+    return " ".join(SAMPLE_WORDS[(start + i) % len(SAMPLE_WORDS)] for i in range(8))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        server = self.server.mock
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        with server._lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            self._complete(server, body)
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+
+    def _complete(self, server, body):
+        prompt_tokens = estimate_prompt_tokens(body.get("messages", []))
+        with server._lock:
+            cached_tokens = cached_prefix_tokens(body.get("messages", []), server.seen_prefixes,
+                                                 server.cache_min_tokens)
+        server.record(body, prompt_tokens, cached_tokens)
+        if server.error_rate and server.random.random() < server.error_rate:
+            headers = {"Retry-After": str(server.retry_after)} if server.error_status == 429 else {}
+            self._send_json(server.error_status, {"error": {"message": "Injected mock error",
+                                                            "type": "mock_error"}}, headers)
+            server.errors += 1
+            return
+        # Cached prefix tokens skip prefill, so they shorten the wait for the first token
+        time.sleep(server.latency * (1 - server.cached_speedup * cached_tokens / max(prompt_tokens, 1)))
+
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            # Structured output: a schema-conforming document, streamed ~4 characters per token
+            with server._lock:
+                document = json.dumps(sample_from_schema(response_format["json_schema"]["schema"], server.random))
+            tokens = [document[i:i + 4] for i in range(0, len(document), 4)]
+            separator = ""
+        else:
+            with server._lock:
+                length = server.response_words
+                if server.response_words_spread:
+                    length = max(1, round(length * server.random.lognormvariate(0, server.response_words_spread)))
+            tokens = [SAMPLE_WORDS[i % len(SAMPLE_WORDS)] for i in range(length)]
+            separator = " "
+        finish_reason = "stop"
+        if body.get("max_tokens") and len(tokens) > body["max_tokens"]:
+            tokens, finish_reason = tokens[:body["max_tokens"]], "length"
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens),
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": body.get("model", "mock")}
+
+        if not body.get("stream"):
+            self._send_json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": finish_reason,
+                             "message": {"role": "assistant", "content": separator.join(tokens)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "finish_reason": None,
+                                  "delta": {"content": token if i == 0 else separator + token}}]}
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(server.token_delay)
+        chunk = {**base, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "finish_reason": finish_reason, "delta": {}}]}
+        self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._send_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_delay=0.0, response_words=60,
+                 error_rate=0.0, error_status=429, retry_after=1, seed=None, cache_min_tokens=1024,
+                 cached_speedup=0.5, response_words_spread=0.0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.response_words = response_words
+        # Free-form answers vary in length like a model's: response_words times a
+        # log-normal factor with this sigma (0 keeps every answer the same length)
+        self.response_words_spread = response_words_spread
+        # Fraction of requests answered with error_status (429s carry a Retry-After header)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        # Prompt prefix caching: shortest cacheable prefix, and the fraction of the
+        # latency a fully cached prompt saves
+        self.cache_min_tokens = cache_min_tokens
+        self.cached_speedup = cached_speedup
+        self.seen_prefixes = set()
+        self.errors = 0
+        self.requests = []
+        # Requests being answered right now, and the most seen at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record(self, body, prompt_tokens, cached_tokens=0):
+        with self._lock:
+            self.requests.append({"model": body.get("model"), "prompt_tokens": prompt_tokens,
+                                  "cached_tokens": cached_tokens, "stream": bool(body.get("stream")),
+                                  "time": time.time()})
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first byte")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed tokens")
+    parser.add_argument("--response-words", type=int, default=60)
+    parser.add_argument("--response-words-spread", type=float, default=0.0,
+                        help="Sigma of the log-normal spread in free-form answer length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="Shortest prompt prefix that is cached")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.host, args.port, args.latency, args.token_delay, args.response_words,
+                              args.error_rate, args.error_status, args.retry_after,
+                              cache_min_tokens=args.cache_min_tokens,
+                              response_words_spread=args.response_words_spread)
+    print(f"Serving mock completions at {server.base_url} (set OPENAI_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# bcrypt cost factor; each +1 doubles the time per hash and per verification
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(os.cpu_count() or 2)))
+# Hash/verify jobs allowed to wait for a worker before new logins are turned away
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "64"))
+BCRYPT_QUEUE_TIMEOUT = float(os.getenv("BCRYPT_QUEUE_TIMEOUT", "10"))
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def is_bcrypt_hash(stored):
+    return stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def hash_rounds(stored):
+    return int(stored.split("$")[2])
+
+
+class PasswordHasher:
+    # bcrypt releases the GIL while hashing, so running it on a small thread pool keeps
+    # login storms from stalling other sessions' script threads; the semaphore bounds how
+    # many jobs may queue so a storm fails fast instead of piling up unbounded work.
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=BCRYPT_WORKERS, max_pending=BCRYPT_MAX_PENDING,
+                 queue_timeout=BCRYPT_QUEUE_TIMEOUT):
+        self.rounds = rounds
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusy("Too many logins in progress, please try again shortly.")
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, password.encode("utf-8"), salt).decode("utf-8")
+
+    def verify(self, password, stored):
+        if not stored:
+            return False
+        if not is_bcrypt_hash(stored):
+            # Legacy plaintext row; migrated to a hash by the caller after a successful login
+            return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        return self._run(bcrypt.checkpw, password.encode("utf-8"), stored.encode("utf-8"))
+
+    def needs_rehash(self, stored):
+        return not is_bcrypt_hash(stored) or hash_rounds(stored) != self.rounds
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import random
+import re
+import threading
+from collections import OrderedDict
+
+# Answers reworded repeats of earlier first-turn chat questions ("does toothpaste help
+# acne" / "can toothpaste help with acne?") from memory. Questions are normalized to
+# word unigrams and bigrams, bucketed by MinHash LSH, and a candidate is served only if
+# the exact Jaccard similarity of the two shingle sets clears the threshold and both
+# questions name the same key terms (who it is for, skin type, numbers, negations, ingredients),
+# since those change the medical answer even when the wording barely moves.
+
+QUESTION_CACHE_THRESHOLD = float(os.getenv("QUESTION_CACHE_THRESHOLD", "0.65"))
+QUESTION_CACHE_MAX_ENTRIES = int(os.getenv("QUESTION_CACHE_MAX_ENTRIES", "2000"))
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240501)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+STOPWORDS = frozenset(
+    "a an the is are was were be been am do does did can could should would will shall may might must "
+    "i me my we our you your he she they them their to of in on for with at by from about as and or "
+    "if so than then too very just really any some what which who whom how why when where there here "
+    "have has had get got please tell know okay ok hi hello thanks thank use using take need".split()
+)
+# Questions that lean on earlier turns or on something only the user can see
+CONTEXT_WORDS = frozenset(
+    "it this that these those above previous earlier before mentioned said again same instead "
+    "also still more else other another".split()
+)
+# Who the question is about, folded to one term per group
+POPULATION_WORDS = {
+    **dict.fromkeys("oily dry sensitive combination".split(), None),
+    **dict.fromkeys("baby babies infant infants newborn newborns toddler toddlers".split(), "baby"),
+    **dict.fromkeys("child children kid kids".split(), "child"),
+    **dict.fromkeys("teen teens teenager teenagers adolescent adolescents puberty".split(), "teen"),
+    **dict.fromkeys("adult adults".split(), "adult"),
+    **dict.fromkeys("elderly senior seniors".split(), "elderly"),
+    **dict.fromkeys("pregnant pregnancy".split(), "pregnancy"),
+    **dict.fromkeys("breastfeeding nursing".split(), "breastfeeding"),
+    **dict.fromkeys("man men male males boy boys".split(), "male"),
+    **dict.fromkeys("woman women female females girl girls".split(), "female"),
+}
+INGREDIENT_WORDS = frozenset(
+    "benzoyl peroxide salicylic glycolic lactic mandelic azelaic hyaluronic retinol retinoid retinoids "
+    "retinal tretinoin adapalene differin tazarotene isotretinoin accutane niacinamide sulfur zinc "
+    "clindamycin doxycycline minocycline erythromycin spironolactone dapsone tea tree witch hazel "
+    "aloe vitamin aha bha toothpaste".split()
+)
+_NEGATION = re.compile(r"\b(?:not|no|never|without|cannot)\b|n['\u2019]t\b")
+_WORD = re.compile(r"[a-z0-9%]+")
+
+
+def stem(word):
+    # Crude suffix folding so "pimples"/"pimple" and "moisturized"/"moisturize" match
+    for suffix in ("ing", "ed", "es", "s", "e"):
+        if word.endswith(suffix) and not word.endswith("ss") and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def normalize(question):
+    return [stem(word) for word in _WORD.findall(question.lower()) if word not in STOPWORDS]
+
+
+def shingles(question):
+    words = normalize(question)
+    return frozenset(words) | frozenset(f"{a} {b}" for a, b in zip(words, words[1:]))
+
+
+def key_terms(question):
+    # Terms two questions must share before one may answer the other
+    text = question.lower()
+    terms = set()
+    for word in _WORD.findall(text):
+        if word in POPULATION_WORDS:
+            terms.add(POPULATION_WORDS[word] or word)
+        elif word in INGREDIENT_WORDS or word[0].isdigit():
+            terms.add(word)
+    if _NEGATION.search(text):
+        terms.add("not")
+    return frozenset(terms)
+
+
+def is_context_dependent(question):
+    return any(word in CONTEXT_WORDS for word in _WORD.findall(question.lower()))
+
+
+def minhash(shingle_set):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+              for shingle in shingle_set]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class QuestionCache:
+    def __init__(self, threshold=QUESTION_CACHE_THRESHOLD, max_entries=QUESTION_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # entry id -> (namespace, shingles, key terms, bands, answer)
+        self._buckets = {}  # (namespace, band index, band) -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _bands(signature):
+        rows = NUM_PERMUTATIONS // LSH_BANDS
+        return [signature[i * rows:(i + 1) * rows] for i in range(LSH_BANDS)]
+
+    def get(self, question, namespace=""):
+        # Returns (answer, similarity) for the closest cached question, or (None, 0.0)
+        question_shingles = shingles(question)
+        if not question_shingles:
+            return None, 0.0
+        terms = key_terms(question)
+        bands = self._bands(minhash(question_shingles))
+        with self._lock:
+            candidates = set()
+            for index, band in enumerate(bands):
+                candidates |= self._buckets.get((namespace, index, band), set())
+            best, best_similarity = None, 0.0
+            for entry_id in candidates:
+                if self._entries[entry_id][2] != terms:
+                    continue
+                similarity = jaccard(question_shingles, self._entries[entry_id][1])
+                if similarity > best_similarity:
+                    best, best_similarity = entry_id, similarity
+            if best is None or best_similarity < self.threshold:
+                self.misses += 1
+                return None, best_similarity
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best][4], best_similarity
+
+    def set(self, question, answer, namespace=""):
+        question_shingles = shingles(question)
+        if not question_shingles:
+            return
+        bands = self._bands(minhash(question_shingles))
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (namespace, question_shingles, key_terms(question), bands, answer)
+            for index, band in enumerate(bands):
+                self._buckets.setdefault((namespace, index, band), set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        entry_id, (namespace, _, _, bands, _) = self._entries.popitem(last=False)
+        for index, band in enumerate(bands):
+            bucket = self._buckets.get((namespace, index, band))
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[(namespace, index, band)]
+        self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
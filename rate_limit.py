@@ -0,0 +1,188 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+
+import openai
+from tenacity import (AsyncRetrying, Retrying, retry_if_exception_type, stop_after_attempt,
+                      wait_random_exponential)
+
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+OPENAI_MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "5"))
+OPENAI_MAX_BACKOFF = float(os.getenv("OPENAI_MAX_BACKOFF", "30"))
+# Random extra wait on top of a server's Retry-After, as a fraction of it (at least half a
+# second), so sessions rejected together don't all retry at the same instant
+OPENAI_RETRY_AFTER_JITTER = float(os.getenv("OPENAI_RETRY_AFTER_JITTER", "0.25"))
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class TokenBucket:
+    # Refills continuously at limit_per_minute. reserve() always succeeds and returns how
+    # long the caller must wait; the balance may go negative, so concurrent callers queue
+    # up behind each other instead of all retrying the moment capacity frees up.
+
+    def __init__(self, limit_per_minute):
+        self.limit = limit_per_minute
+        self.rate = limit_per_minute / 60
+        self._tokens = float(limit_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.limit, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount=1):
+        if self.limit <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.limit)
+            return max(0.0, -self._tokens / self.rate)
+
+    def adjust(self, amount):
+        # Return (positive) or charge (negative) the difference once actual usage is known
+        if self.limit <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.limit, self._tokens + amount)
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+# Process-wide, so every session and the batch CLI draw from the same quota
+request_bucket = TokenBucket(OPENAI_RPM_LIMIT)
+token_bucket = TokenBucket(OPENAI_TPM_LIMIT)
+
+
+def estimate_request_tokens(request):
+    # Text at ~4 chars/token, images at their size and detail for the model, plus the
+    # completion budget
+    tokens = 0
+    for message in request.get("messages", []):
+        content = message.get("content") or ""
+        parts = [{"type": "text", "text": content}] if isinstance(content, str) else content
+        for part in parts:
+            if part.get("type") == "text":
+                tokens += len(part["text"]) // 4
+            elif part.get("type") == "image_url":
+                from image_utils import estimate_image_url_tokens
+
+                image_url = part["image_url"]
+                tokens += estimate_image_url_tokens(image_url["url"], image_url.get("detail", "auto"),
+                                                    request.get("model", "gpt-4o"))
+    return tokens + request.get("max_tokens", 1000)
+
+
+def retry_after_seconds(exc):
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    retry_after_ms = response.headers.get("retry-after-ms")
+    retry_after = response.headers.get("retry-after")
+    try:
+        if retry_after_ms:
+            return float(retry_after_ms) / 1000
+        if retry_after:
+            return float(retry_after)
+    except ValueError:
+        pass
+    if retry_after:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+class _WaitRetryAfter:
+    # Honor the server's Retry-After when present, otherwise jittered exponential backoff
+    def __init__(self):
+        self.fallback = wait_random_exponential(multiplier=0.5, max=OPENAI_MAX_BACKOFF)
+
+    def __call__(self, retry_state):
+        exc = retry_state.outcome.exception()
+        retry_after = retry_after_seconds(exc)
+        if retry_after is not None:
+            retry_after = min(retry_after, OPENAI_MAX_BACKOFF)
+            return retry_after + random.uniform(0, max(0.5, retry_after * OPENAI_RETRY_AFTER_JITTER))
+        return self.fallback(retry_state)
+
+
+class CallStats:
+    def __init__(self):
+        self.queued_time = 0.0
+        self.attempts = 0
+
+
+def _retry_options(stats, on_wait):
+    def before_sleep(retry_state):
+        seconds = retry_state.next_action.sleep
+        stats.queued_time += seconds
+        if on_wait is not None:
+            on_wait(seconds, f"retrying after {type(retry_state.outcome.exception()).__name__}")
+
+    return {
+        "retry": retry_if_exception_type(RETRYABLE_ERRORS),
+        "wait": _WaitRetryAfter(),
+        "stop": stop_after_attempt(OPENAI_MAX_ATTEMPTS),
+        "before_sleep": before_sleep,
+        "reraise": True,
+    }
+
+
+def _reserve(estimated, stats, on_wait):
+    wait = max(request_bucket.reserve(1), token_bucket.reserve(estimated))
+    if wait > 0:
+        if on_wait is not None:
+            on_wait(wait, "client-side rate limit")
+        stats.queued_time += wait
+    return wait
+
+
+def call_with_retry(fn, request, stats=None, on_wait=None):
+    # Calls fn(**request) with retries on 429s, timeouts, connection errors and 5xx
+    # responses. Every attempt first waits for RPM/TPM capacity; a failed attempt keeps
+    # its request slot but hands its token estimate back, since nothing was generated.
+    stats = stats or CallStats()
+    estimated = estimate_request_tokens(request)
+    for attempt in Retrying(**_retry_options(stats, on_wait)):
+        with attempt:
+            time.sleep(_reserve(estimated, stats, on_wait))
+            stats.attempts += 1
+            try:
+                result = fn(**request)
+            except Exception:
+                token_bucket.adjust(estimated)
+                raise
+    return result, stats, estimated
+
+
+async def async_call_with_retry(fn, request, stats=None, on_wait=None):
+    stats = stats or CallStats()
+    estimated = estimate_request_tokens(request)
+    async for attempt in AsyncRetrying(**_retry_options(stats, on_wait)):
+        with attempt:
+            await asyncio.sleep(_reserve(estimated, stats, on_wait))
+            stats.attempts += 1
+            try:
+                result = await fn(**request)
+            except Exception:
+                token_bucket.adjust(estimated)
+                raise
+    return result, stats, estimated
+
+
+def settle_usage(estimated, usage):
+    # Correct the token bucket with what the request actually consumed
+    if usage is not None:
+        token_bucket.adjust(estimated - usage.total_tokens)
@@ -0,0 +1,234 @@
+import itertools
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+import zlib
+
+import metrics
+
+# Process-wide home for the bulky per-session state (chat history, prepared uploads,
+# analysis results). Pages keep it here instead of in st.session_state so its size can
+# be measured and bounded: when a session goes over its budget, or all sessions over
+# the global one, the least recently used values are pickled, compressed and written
+# to disk, then loaded back transparently the next time the session reads them.
+
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", str(1024 * 1024)))
+SESSION_MEMORY_GLOBAL_BUDGET = int(os.getenv("SESSION_MEMORY_GLOBAL_BUDGET", str(256 * 1024 * 1024)))
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR", ".session_spill")
+# Sessions idle this long are spilled entirely; after SESSION_SPILL_TTL they are dropped
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "300"))
+SESSION_SPILL_TTL = float(os.getenv("SESSION_SPILL_TTL", str(24 * 3600)))
+SWEEP_INTERVAL = 30
+
+
+def deep_sizeof(obj, seen=None):
+    # Bytes held by obj and everything it references (shared objects counted once)
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+class _Entry:
+    def __init__(self, value):
+        self.value = value
+        self.memory_bytes = deep_sizeof(value)
+        self.disk_bytes = 0
+        self.path = None
+        self.last_access = time.time()
+        self.spilling = False
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+
+class SessionStore:
+    def __init__(self, budget=SESSION_MEMORY_BUDGET, global_budget=SESSION_MEMORY_GLOBAL_BUDGET,
+                 directory=SESSION_SPILL_DIR, idle_seconds=SESSION_IDLE_SECONDS, spill_ttl=SESSION_SPILL_TTL):
+        self.budget = budget
+        self.global_budget = global_budget
+        self.directory = directory
+        self.idle_seconds = idle_seconds
+        self.spill_ttl = spill_ttl
+        self._sessions = {}  # session id -> {key: _Entry}
+        self._owners = {}
+        self._last_seen = {}
+        self._memory_bytes = 0
+        self._session_bytes = {}  # session id -> bytes of its values held in memory
+        self._spill_ids = itertools.count()
+        self._last_sweep = time.monotonic()
+        self._lock = threading.RLock()
+        self.spills = 0
+        self.reloads = 0
+
+    def _path(self, session, key):
+        # Unique per spill, so a stale write never lands on a newer value's file
+        return os.path.join(self.directory, session, f"{key}.{next(self._spill_ids)}.pkl.z")
+
+    def get(self, session, key, default=None):
+        with self._lock:
+            entry = self._sessions.get(session, {}).get(key)
+            self._last_seen[session] = time.time()
+            if entry is None:
+                return default
+            if entry.spilled:
+                self._reload(session, entry)
+            entry.last_access = time.time()
+            value = entry.value
+            victims, expired = self._enforce(session, key)
+        self._write_out(victims, expired)
+        return value
+
+    def set(self, session, key, value):
+        # Call again after mutating a value in place so its size is re-measured
+        entry = _Entry(value)
+        with self._lock:
+            entries = self._sessions.setdefault(session, {})
+            previous = entries.get(key)
+            if previous is not None:
+                self._drop(session, previous)
+            entries[key] = entry
+            self._account(session, entry.memory_bytes)
+            self._last_seen[session] = time.time()
+            victims, expired = self._enforce(session, key)
+        self._write_out(victims, expired)
+
+    def clear(self, session):
+        with self._lock:
+            for entry in self._sessions.pop(session, {}).values():
+                self._drop(session, entry)
+            self._session_bytes.pop(session, None)
+            self._owners.pop(session, None)
+            self._last_seen.pop(session, None)
+        shutil.rmtree(os.path.join(self.directory, session), ignore_errors=True)
+
+    def set_owner(self, session, owner):
+        with self._lock:
+            self._owners[session] = owner
+
+    def _account(self, session, delta):
+        self._memory_bytes += delta
+        self._session_bytes[session] = self._session_bytes.get(session, 0) + delta
+
+    def _drop(self, session, entry):
+        if entry.spilled:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        elif not entry.spilling:
+            self._account(session, -entry.memory_bytes)
+
+    def _write_out(self, victims, expired):
+        # Pickling, compression and disk writes happen without the lock held. A value read
+        # or replaced while its file was being written stays in memory instead.
+        for session, key, entry, last_access in victims:
+            path = self._path(session, key)
+            try:
+                data = zlib.compress(pickle.dumps(entry.value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            except (OSError, RuntimeError, pickle.PicklingError):
+                data = None
+            with self._lock:
+                entry.spilling = False
+                current = self._sessions.get(session, {}).get(key) is entry
+                if data is not None and current and entry.last_access == last_access:
+                    entry.value, entry.path, entry.disk_bytes = None, path, len(data)
+                    self.spills += 1
+                    metrics.increment("session_state_spills")
+                    continue
+                if current:
+                    self._account(session, entry.memory_bytes)
+            if data is not None:
+                os.remove(path)
+        for session in expired:
+            self.clear(session)
+
+    def _reload(self, session, entry):
+        with open(entry.path, "rb") as f:
+            entry.value = pickle.loads(zlib.decompress(f.read()))
+        os.remove(entry.path)
+        entry.path, entry.disk_bytes = None, 0
+        entry.memory_bytes = deep_sizeof(entry.value)
+        self._account(session, entry.memory_bytes)
+        self.reloads += 1
+        metrics.increment("session_state_reloads")
+
+    def _in_memory(self, session=None):
+        sessions = [session] if session is not None else list(self._sessions)
+        return [(name, key, entry) for name in sessions for key, entry in self._sessions.get(name, {}).items()
+                if not entry.spilled and not entry.spilling]
+
+    def _enforce(self, session, keep):
+        # Picks least recently used values to spill, never the one being read or written
+        # right now. Candidates are only gathered once a budget is actually exceeded.
+        victims, expired = [], []
+
+        def spill_until(candidates, over_budget):
+            for name, key, entry in sorted(candidates, key=lambda item: item[2].last_access):
+                if not over_budget():
+                    return
+                if (name, key) != (session, keep):
+                    entry.spilling = True
+                    self._account(name, -entry.memory_bytes)
+                    victims.append((name, key, entry, entry.last_access))
+
+        if self._session_bytes.get(session, 0) > self.budget:
+            spill_until(self._in_memory(session), lambda: self._session_bytes[session] > self.budget)
+        if self._memory_bytes > self.global_budget:
+            spill_until(self._in_memory(), lambda: self._memory_bytes > self.global_budget)
+        if time.monotonic() - self._last_sweep > SWEEP_INTERVAL:
+            self._last_sweep = time.monotonic()
+            now = time.time()
+            for name in list(self._sessions):
+                idle = now - self._last_seen.get(name, now)
+                if name == session:
+                    continue
+                if idle > self.spill_ttl:
+                    expired.append(name)
+                elif idle > self.idle_seconds:
+                    spill_until(self._in_memory(name), lambda: True)
+        return victims, expired
+
+    def session_stats(self):
+        with self._lock:
+            now = time.time()
+            rows = []
+            for session, entries in self._sessions.items():
+                rows.append({
+                    "session": session,
+                    "owner": self._owners.get(session),
+                    "memory_bytes": self._session_bytes.get(session, 0),
+                    "disk_bytes": sum(e.disk_bytes for e in entries.values() if e.spilled),
+                    "keys": ", ".join(f"{key}*" if e.spilled else key for key, e in sorted(entries.items())),
+                    "idle_seconds": round(now - self._last_seen.get(session, now)),
+                })
+            return sorted(rows, key=lambda row: row["memory_bytes"], reverse=True)
+
+    def stats(self):
+        with self._lock:
+            disk = sum(e.disk_bytes for entries in self._sessions.values() for e in entries.values())
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": disk,
+                "budget": self.budget,
+                "global_budget": self.global_budget,
+                "spills": self.spills,
+                "reloads": self.reloads,
+            }
@@ -1,10 +1,17 @@
 import streamlit as st
-import pandas as pd
-import base64
-from openai import OpenAI
-import openai
 import os
 from dotenv import load_dotenv
+from credentials_store import CredentialStore
+from password_hashing import PasswordHasher, PasswordHasherBusy
+from analysis import ANALYSIS_MAX_TOKENS, ANALYSIS_MODEL, analysis_cache_key, run_analysis_job
+from prompts import ACNE_ANALYSIS, DERMATOLOGIST
+from analysis_cache import AnalysisCache
+from jobs import JobQueue
+from session_store import SessionStore
+import metrics
+
+# openai (~0.8s to import), Pillow and the modules built on them are imported inside the
+# pages that use them, so the login and static pages start without paying for them.
 
 st.set_page_config(page_title="Acne Detection & Solution", layout="centered")
 
@@ -35,53 +42,157 @@ st.markdown(
 
 
 
-api_key = st.secrets["general"]["OPENAI_API_KEY"]
+# One pooled OpenAI client per server process, shared by every session and rerun
+@st.cache_resource
+def get_openai_client():
+    from llm_client import create_openai_client
 
-# Initialize OpenAI client
-client = OpenAI(api_key=api_key)
+    return create_openai_client(st.secrets["general"]["OPENAI_API_KEY"])
 
 
 
 
-CREDENTIALS_FILE = "user_credentials.csv"
+CREDENTIALS_FILE = os.getenv("CREDENTIALS_FILE", "user_credentials.csv")
+# Usernames that see the Admin page
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
+CHAT_MODEL = "gpt-4o-mini"
+DERMATOLOGIST_PROMPT = DERMATOLOGIST.text
 
 
-def load_credentials():
-    try:
-        return pd.read_csv(CREDENTIALS_FILE)
-    except FileNotFoundError:
-        return pd.DataFrame(columns=["username", "email", "password", "security_question", "security_answer"])
+# One indexed store per server process, shared by every session
+@st.cache_resource
+def get_credential_store():
+    return CredentialStore(CREDENTIALS_FILE)
 
 
-def save_credentials(username, email, password, security_question, security_answer):
-    credentials = load_credentials()
-    new_user = pd.DataFrame({
-        "username": [username], "email": [email],
-        "password": [password],
-        "security_question": [security_question],
-        "security_answer": [security_answer]
-    })
-    updated_credentials = pd.concat([credentials, new_user], ignore_index=True)
-    updated_credentials.to_csv(CREDENTIALS_FILE, index=False)
+@st.cache_resource
+def get_analysis_cache():
+    return AnalysisCache()
 
 
-def authenticate_user(username, password):
-    credentials = load_credentials()
-    user = credentials[(credentials['username'] == username) & (credentials['password'] == password)]
-    return not user.empty
+# Analyses run here rather than in script threads, so reruns can't interrupt them
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+
+# Near-duplicate first-turn chat questions, shared by every session
+@st.cache_resource
+def get_question_cache():
+    from question_cache import QuestionCache
+
+    return QuestionCache()
+
+
+# Bulky per-session state lives here, within a memory budget, instead of in st.session_state
+@st.cache_resource
+def get_session_store():
+    return SessionStore()
+
+
+# Saved analyses for the history page, one database per server process
+@st.cache_resource
+def get_analysis_history():
+    from analysis_history import AnalysisHistory
+
+    return AnalysisHistory()
+
 
+def session_key():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-def recover_password(email, security_answer):
-    credentials = load_credentials()
-    user = credentials[(credentials['email'] == email) & (credentials['security_answer'] == security_answer)]
-    if not user.empty:
-        return user['password'].values[0]
-    return None
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "default"
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+def session_get(key, default=None):
+    return get_session_store().get(session_key(), key, default)
+
+
+def session_set(key, value):
+    get_session_store().set(session_key(), key, value)
+
+
+# bcrypt work runs on a bounded pool shared by every session
+@st.cache_resource
+def get_password_hasher():
+    return PasswordHasher()
+
+
+def save_credentials(username, email, password, security_question, security_answer):
+    store = get_credential_store()
+    if store.username_exists(username):
+        return False
+    password_hash = get_password_hasher().hash(password)
+    return store.add_user(username, email, password_hash, security_question, security_answer)
+
+
+def authenticate_user(username, password):
+    store = get_credential_store()
+    hasher = get_password_hasher()
+    user = store.get_user(username)
+    if user is None or not hasher.verify(password, user["password"]):
+        return False
+    # Plaintext rows (and hashes made with an old cost factor) are upgraded on login. When
+    # the hashing pool is full the upgrade waits for a later login; this one still succeeds.
+    if hasher.needs_rehash(user["password"]):
+        try:
+            store.update_user(username, password=hasher.hash(password))
+        except PasswordHasherBusy:
+            pass
+    return True
+
+
+def reset_password(email, security_answer, new_password):
+    store = get_credential_store()
+    user = store.find_user_for_recovery(email, security_answer)
+    if user is None:
+        return False
+    return store.update_user(user["username"], password=get_password_hasher().hash(new_password))
+
+
+CROP_RATIO_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0)
+
+# Static images, with the longest edge to render them at: twice their displayed width
+# so they stay sharp on high-DPI screens
+BRANDING_ASSETS = {
+    "logo": ("IMG_5251.jpeg.jpg", 300),
+}
+
+
+# Branding images are downscaled once per server process and preloaded at startup, so
+# reruns send the browser a small cached rendition instead of re-reading the full file
+@st.cache_resource
+def get_branding_assets():
+    from image_utils import PREVIEW_MAX_EDGE, make_preview
+
+    assets = {}
+    for name, (path, max_edge) in BRANDING_ASSETS.items():
+        with open(path, "rb") as f:
+            assets[name] = make_preview(f.read(), max_edge if PREVIEW_MAX_EDGE else 0)
+    return assets
+
+
+def get_prepared_upload(uploaded_file):
+    from face_screen import screen_image
+    from image_utils import make_preview, prepare_image
+
+    # Downscale, encode and pre-screen each upload once per session instead of on every
+    # rerun, along with the display-sized preview shown in its place
+    cached = session_get("prepared_upload")
+    if cached is None or cached["file_id"] != uploaded_file.file_id:
+        with metrics.span("preprocess", page="acne_analysis"):
+            cached = {"file_id": uploaded_file.file_id, "image": prepare_image(uploaded_file.getvalue())}
+            cached["preview"] = make_preview(uploaded_file.getvalue())
+        metrics.increment("preview_bytes_saved", uploaded_file.size - len(cached["preview"]))
+        if cached["image"].crop_ratio < 1:
+            metrics.observe("image_crop_ratio", cached["image"].crop_ratio, buckets=CROP_RATIO_BUCKETS)
+            metrics.increment("image_bytes_saved", cached["image"].bytes_saved)
+            metrics.increment("image_tiles_saved", cached["image"].tiles_saved)
+        with metrics.span("face_screen", page="acne_analysis"):
+            cached["screen"] = screen_image(uploaded_file.getvalue())
+        session_set("prepared_upload", cached)
+    return cached["image"], cached["screen"], cached["preview"]
 
 
 def sign_up():
@@ -94,27 +205,36 @@ def sign_up():
     security_answer = st.text_input("Answer to security question")
     if st.button("Sign Up"):
         if username and email and password and security_answer:
-            credentials = load_credentials()
-            if "username" in credentials.columns and username in credentials["username"].values:
-                st.error("Username already exists! Please choose another.")
-            else:
-                save_credentials(username, email, password, security_question, security_answer)
+            try:
+                created = save_credentials(username, email, password, security_question, security_answer)
+            except PasswordHasherBusy as exc:
+                st.error(str(exc))
+                return
+            if created:
                 st.success("Sign-Up Successful! Please proceed to login.")
+            else:
+                st.error("Username already exists! Please choose another.")
         else:
             st.warning("Please fill in all fields.")
 
 
 def login():
-    st.image("IMG_5251.jpeg.jpg", use_container_width=False, width=150)
+    st.image(get_branding_assets()["logo"], use_container_width=False, width=150)
 
     st.title("Login")
     username = st.text_input("Enter your username")
     password = st.text_input("Enter your password", type="password")
     if st.button("Login"):
         if username and password:
-            if authenticate_user(username, password):
+            try:
+                authenticated = authenticate_user(username, password)
+            except PasswordHasherBusy as exc:
+                st.error(str(exc))
+                return
+            if authenticated:
                 st.session_state["logged_in"] = True
                 st.session_state["username"] = username
+                get_session_store().set_owner(session_key(), username)
                 st.success(f"Welcome back, {username}!")
             else:
                 st.error("Invalid username or password!")
@@ -126,10 +246,18 @@ def password_recovery():
     st.title("Password Recovery")
     email = st.text_input("Enter your registered email")
     security_answer = st.text_input("Answer to your security question")
-    if st.button("Recover Password"):
-        recovered_password = recover_password(email, security_answer)
-        if recovered_password:
-            st.success(f"Your password is: {recovered_password}")
+    new_password = st.text_input("Choose a new password", type="password")
+    if st.button("Reset Password"):
+        if not (email and security_answer and new_password):
+            st.warning("Please fill in all fields.")
+            return
+        try:
+            reset = reset_password(email, security_answer, new_password)
+        except PasswordHasherBusy as exc:
+            st.error(str(exc))
+            return
+        if reset:
+            st.success("Your password has been reset. Please proceed to login.")
         else:
             st.error("Incorrect email or security answer.")
 
@@ -139,13 +267,10 @@ def password_recovery():
 def profile_setup():
     st.title("Profile Setup Page")
 
-    if "profile_data" not in st.session_state:
-        st.session_state["profile_data"] = None
-
     # Display saved profile data at the top
-    if st.session_state["profile_data"]:
+    profile_data = session_get("profile_data")
+    if profile_data:
         st.subheader("Your Saved Profile")
-        profile_data = st.session_state["profile_data"]
         st.write(f"**Name:** {profile_data['first_name']} {profile_data['last_name']}")
         st.write(f"**Age:** {profile_data['age']} ({profile_data['dob']})")
         st.write(f"**Gender:** {profile_data['gender']}")
@@ -188,7 +313,7 @@ def profile_setup():
     sleep_hours = st.selectbox("How many hours of sleep do you get per night?", ["Less than 5", "5-7", "More than 7"])
 
     if st.button("Save Profile"):
-        st.session_state["profile_data"] = {
+        session_set("profile_data", {
             "first_name": first_name,
             "last_name": last_name,
             "age": age,
@@ -205,7 +330,7 @@ def profile_setup():
             "diet": diet,
             "water_intake": water_intake,
             "sleep_hours": sleep_hours
-        }
+        })
         st.success("Profile information saved successfully!")
         st.rerun()  # Refresh the page to display saved data at the top
 
@@ -350,89 +475,386 @@ def faq_page():
     """)
 
 
+def notify_wait(seconds, reason):
+    if seconds >= 1:
+        st.toast(f"High demand right now: your request is queued for ~{seconds:.0f}s ({reason}).", icon="⏳")
+
+
 def acne_analysis():
+    from PIL import UnidentifiedImageError
+    from face_screen import FACE_SCREEN_ENABLED
+
     st.title("📸 AI Acne Analyzer")
     st.write("Upload an image of your face, and our AI will analyze your acne and provide personalized skincare advice.")
     uploaded_file = st.file_uploader("Upload Image", type=["jpg", "jpeg", "png"])
 
     if uploaded_file is not None:
-        image_path = "uploaded_image.png"
-        with open(image_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-
-        st.image(image_path, caption="Uploaded Image", use_container_width=True)
-        base64_image = encode_image(image_path)
+        try:
+            image, screen, preview = get_prepared_upload(uploaded_file)
+        except UnidentifiedImageError:
+            st.error("This file could not be read as an image. Please upload a JPG or PNG photo.")
+            return
+        with metrics.span("upload_preview", page="acne_analysis"):
+            st.image(preview, caption="Uploaded Image", use_container_width=True)
+
+        # Obvious non-faces (screenshots, logos, blank images) never reach the paid API
+        skip_screen = False
+        if FACE_SCREEN_ENABLED and not screen.passed:
+            st.warning("This doesn't look like a photo of a face or skin, so it won't be sent for analysis.")
+            skip_screen = st.checkbox("It is a photo of my skin, analyze it anyway")
 
         if st.button("Analyze Acne 🧴"):
-            with st.spinner("Analyzing... Please wait."):
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system",
-                         "content": "You are an AI skincare assistant. Analyze acne severity based on the image and provide personalized skincare, dietary, and lifestyle recommendations."
-                                    "you response should contain first the type of acne of specific part of face that you identified it. do not include in the image etc in your response"
-                                    "you must provide the stage of the acne as well."
-                                    "after that you should provide the solution."
-                                    "Please note you only entertain the images that  have human face or have acne. you will not entertain any other images."},
-                        {"role": "user", "content": [
-                            {"type": "text", "text": "Here is the image."},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}},
-                        ]},
-                    ],
-                )
-                st.success("Analysis Complete!")
-                st.subheader("AI Diagnosis & Skincare Advice:")
-                st.write(response.choices[0].message.content)
+            if FACE_SCREEN_ENABLED and not screen.passed and not skip_screen:
+                metrics.increment("face_screen", result="rejected")
+                st.error("Please upload a clear photo of your face or the affected skin.")
+                return
+            metrics.increment("face_screen", result="passed" if screen.passed else "overridden")
+            submit_analysis(uploaded_file.file_id, image)
+
+        # The job id lives in session state, so reruns and widget changes while the
+        # analysis runs don't lose it; the result is picked up whenever it's ready
+        entry = session_get("analysis")
+        if entry is not None and entry["file_id"] == uploaded_file.file_id:
+            show_analysis(entry, image)
+
+
+def submit_analysis(file_id, image):
+    import hashlib
+    from analysis_history import ANALYSIS_HISTORY_THUMBNAIL_EDGE
+    from image_utils import make_thumbnail
+
+    cache = get_analysis_cache()
+    with metrics.span("cache_lookup", page="acne_analysis"):
+        key = analysis_cache_key(image)
+        result = cache.get(key)
+    entry = {"file_id": file_id, "key": key, "job_id": None, "result": result, "timing": "Served from cache"}
+
+    # Every analysis the user runs goes into their history, cache hits included
+    username = st.session_state.get("username")
+    image_hash = hashlib.sha256(image.data).hexdigest()
+    thumbnail = make_thumbnail(image.data, ANALYSIS_HISTORY_THUMBNAIL_EDGE)
+    # Resolved here in the script thread; the cached getter can't be called from the worker
+    history = get_analysis_history()
+
+    def save_to_history(result):
+        history.add(username, image_hash, result, thumbnail, ANALYSIS_MODEL, ACNE_ANALYSIS.tag)
+
+    if result is None:
+        client = get_openai_client()
+        # Sessions analyzing the same photo with the same prompt and model share one upstream call.
+        # The result is saved from the worker, so it's kept even if the user leaves the page.
+        job = get_job_queue().submit(lambda job: run_analysis_job(job, client, image, cache, key),
+                                     owner=username, key=key,
+                                     on_done=lambda job: job.status == "done" and save_to_history(job.result))
+        entry["job_id"] = job.id
+    else:
+        save_to_history(result)
+    session_set("analysis", entry)
+
+
+@st.fragment(run_every=1)
+def analysis_progress(job_id):
+    # Only this fragment reruns while the job is in flight; the full page reruns once it's done
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    position = queue.position(job)
+    if position:
+        st.info(f"Your analysis is queued ({position} ahead of it including yours). You can keep using the app.")
+    else:
+        st.info(f"Analyzing... {job.run_time:.0f}s")
+    if job.notice:
+        st.caption(job.notice)
+    if job.text:
+        from analysis_schema import partial_markdown
+
+        # The reply is JSON until it's complete; findings and stage are shown as their fields close,
+        # the routine and advice once the whole report has been validated
+        received = len(job.text) // 4
+        st.progress(min(1.0, received / ANALYSIS_MAX_TOKENS), text=f"Receiving the report... ~{received} tokens")
+        partial = partial_markdown(job.text)
+        if partial:
+            st.markdown(partial)
+
+
+def render_analysis(result):
+    from analysis_schema import AcneAnalysis
+
+    # Results saved before structured output carry only the Markdown text
+    if result.get("analysis") is None:
+        st.write(result["content"])
+        return
+    analysis = AcneAnalysis.model_validate(result["analysis"])
+    if not analysis.is_skin_photo:
+        st.warning(analysis.decline_reason)
+        return
+    st.markdown(analysis.to_markdown())
+
+
+def show_analysis(entry, image):
+    import openai
+    from analysis_schema import AnalysisFormatError
+    from image_utils import format_bytes
+
+    st.subheader("AI Diagnosis & Skincare Advice:")
+    if entry["result"] is None:
+        job = get_job_queue().get(entry["job_id"])
+        if job is None:
+            # Expired from the queue; the worker stored the result in the cache when it finished
+            entry["result"] = get_analysis_cache().get(entry["key"])
+            if entry["result"] is None:
+                st.error("This analysis is no longer available. Please run it again.")
+                return
+        elif not job.done:
+            analysis_progress(job.id)
+            return
+        elif job.error is not None:
+            if isinstance(job.error, openai.APIError):
+                st.error("The AI service is busy right now. Please try again in a minute.")
+            elif isinstance(job.error, AnalysisFormatError):
+                st.error("The analysis came back incomplete. Please try again.")
+            else:
+                st.error("The analysis failed. Please try again.")
+            return
+        else:
+            entry["result"] = job.result
+            entry["timing"] = (
+                f"First token after {job.result['time_to_first_token'] or job.result['total_time']:.2f}s, "
+                f"complete after {job.result['total_time']:.2f}s"
+                + (f" (queued {job.wait_time + job.result['queued_time']:.1f}s)"
+                   if job.wait_time + job.result["queued_time"] >= 0.1 else "")
+            )
+        session_set("analysis", entry)
+
+    result = entry["result"]
+    render_analysis(result)
+    st.success("Analysis Complete!")
+    usage = result["usage"]
+    st.caption(
+        f"Image sent: {format_bytes(image.size)} at {image.width}x{image.height} "
+        f"(uploaded {format_bytes(image.original_size)} at {image.original_width}x{image.original_height}), "
+        f"~{image.estimated_tokens(ANALYSIS_MODEL)} image tokens "
+        f"(~{image.original_estimated_tokens(ANALYSIS_MODEL)} before resizing). "
+        + (f"Cropped to the face region: {image.crop_ratio:.0%} of the image, "
+           f"{format_bytes(image.bytes_saved)} and {image.tiles_saved} image tiles saved. "
+           if image.crop_ratio < 1 else "")
+        + f"Usage: {usage['prompt_tokens']} prompt ({usage.get('cached_tokens', 0)} cached) / "
+        f"{usage['completion_tokens']} completion tokens."
+    )
+    stats = get_analysis_cache().stats()
+    st.caption(
+        f"{entry['timing']} — cache hits: {stats['memory_hits'] + stats['disk_hits']}, "
+        f"misses: {stats['misses']}, hit rate: {stats['hit_rate']:.0%}"
+    )
+
+
+# Analysis History Page
+def history_page():
+    import datetime
+    import math
+    from analysis_history import ANALYSIS_HISTORY_PAGE_SIZE
+    from analysis_schema import STAGES
+
+    st.title("🗂️ Analysis History")
+    history = get_analysis_history()
+    username = st.session_state["username"]
+
+    # An opened result is read from the local database by id; nothing is sent upstream
+    opened = st.session_state.get("history_open")
+    if opened is not None:
+        with metrics.span("history_open", page="analysis_history"):
+            entry = history.get(username, opened)
+        if st.button("⬅️ Back to history"):
+            del st.session_state["history_open"]
+            st.rerun()
+        if entry is None:
+            st.error("This analysis could not be found.")
+            return
+        columns = st.columns([1, 3])
+        columns[0].image(entry["thumbnail"], use_container_width=True)
+        columns[1].caption(
+            f"Analyzed {datetime.datetime.fromtimestamp(entry['created']):%Y-%m-%d %H:%M} "
+            f"with {entry['model']} ({entry['prompt']}). Usage: {entry['prompt_tokens']} prompt "
+            f"({entry['cached_tokens']} cached) / {entry['completion_tokens']} completion tokens."
+        )
+        render_analysis(entry)
+        return
+
+    with metrics.span("history_page", page="analysis_history"):
+        if not history.count(username):
+            st.info("No analyses yet. Results from the Acne Analysis page are saved here.")
+            return
+        stage = st.selectbox("Stage", ["All", *STAGES], format_func=str.title, key="history_stage")
+        stage = None if stage == "All" else stage
+        total = history.count(username, stage)
+        pages = max(1, math.ceil(total / ANALYSIS_HISTORY_PAGE_SIZE))
+        page = min(st.number_input(f"Page (of {pages})", min_value=1, step=1, key="history_page"), pages)
+        rows = history.page(username, page, ANALYSIS_HISTORY_PAGE_SIZE, stage)
+
+    st.caption(f"{total} saved {'analysis' if total == 1 else 'analyses'}, newest first.")
+    for row in rows:
+        thumbnail, details = st.columns([1, 4])
+        thumbnail.image(row["thumbnail"], use_container_width=True)
+        details.markdown(f"**{datetime.datetime.fromtimestamp(row['created']):%Y-%m-%d %H:%M}**  \n{row['summary']}")
+        if details.button("Open", key=f"history_open_{row['id']}"):
+            st.session_state["history_open"] = row["id"]
+            st.rerun()
 
 
 # AI Dermatologist Page
 def ai_dermatologist():
-    st.title("🩺 Ask Anything to AI Dermatologist")
+    import openai
+    from chat_history import ChatHistory, create_summarizer
+    from llm_client import CompletionStream
+    from question_cache import is_context_dependent
 
-    # Initialize OpenAI client only once
-    if "openai_client" not in st.session_state:
-        st.session_state["openai_client"] = OpenAI(api_key=api_key)
+    st.title("🩺 Ask Anything to AI Dermatologist")
 
-    if "messages" not in st.session_state:
-        st.session_state["messages"] = []
+    messages = session_get("messages", [])
 
     # Display only user and assistant messages (not system message)
-    for message in st.session_state["messages"]:
-        if message["role"] != "system":
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+    with metrics.span("history_render", page="ai_dermatologist"):
+        for message in messages:
+            if message["role"] != "system":
+                with st.chat_message(message["role"]):
+                    st.markdown(message["content"])
 
     # User input field (should now be visible)
     user_input = st.chat_input("Ask your skin-related question...")
 
     if user_input:
-        st.session_state["messages"].append({"role": "user", "content": user_input})
+        messages.append({"role": "user", "content": user_input})
+        session_set("messages", messages)
 
         with st.chat_message("user"):
             st.markdown(user_input)
 
-        with st.spinner("Thinking..."):
-            response = st.session_state["openai_client"].chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are an AI Dermatologist. Answer skin-related questions accurately and professionally.you will not entertain any other question at all."},
-                    *st.session_state["messages"]
-                ],
+        # Standalone opening questions can be answered from a reworded earlier one
+        first_turn = len(messages) == 1 and not is_context_dependent(user_input)
+        namespace = f"{DERMATOLOGIST.tag}:{CHAT_MODEL}"
+        if first_turn:
+            answer, similarity = get_question_cache().get(user_input, namespace)
+            metrics.increment("question_cache", result="hit" if answer is not None else "miss")
+            if answer is not None:
+                with st.chat_message("assistant"):
+                    st.markdown(answer)
+                    st.caption(f"⚡ Answered from a similar earlier question ({similarity:.0%} match).")
+                messages.append({"role": "assistant", "content": answer})
+                session_set("messages", messages)
+                return
+
+        # Only the recent turns go out verbatim; older ones are folded into a rolling summary
+        history_state = session_get("chat_history", {})
+        history = ChatHistory(history_state, create_summarizer(get_openai_client(), CHAT_MODEL))
+        try:
+            with metrics.span("history_build", page="ai_dermatologist"):
+                prompt = history.build_messages(DERMATOLOGIST_PROMPT, messages)
+            session_set("chat_history", history_state)
+            stream = CompletionStream(
+                get_openai_client(),
+                "ai_dermatologist",
+                on_wait=notify_wait,
+                model=CHAT_MODEL,
+                messages=prompt,
                 temperature=0.5,
                 max_tokens=400
             )
 
-        ai_response = response.choices[0].message.content
-        st.session_state["messages"].append({"role": "assistant", "content": ai_response})
+            with st.chat_message("assistant"), metrics.span("completion", page="ai_dermatologist"):
+                st.write_stream(stream)
+        except openai.APIError:
+            st.error("The AI service is busy right now. Please try again in a minute.")
+            return
+
+        messages.append({"role": "assistant", "content": stream.text})
+        session_set("messages", messages)
+        if first_turn and stream.text:
+            get_question_cache().set(user_input, stream.text, namespace)
+
+
+
+def admin_page():
+    from llm_client import pool_stats
+
+    st.title("🛠️ Admin")
+    queue = get_job_queue()
+    stats = queue.stats()
+    st.subheader("Analysis jobs")
+    columns = st.columns(5)
+    columns[0].metric("Queue depth", stats["queued"])
+    columns[1].metric("Running", f"{stats['running']} / {stats['workers']}")
+    columns[2].metric("Worker utilization", f"{stats['utilization']:.0%}",
+                      help=f"Average since start: {stats['average_utilization']:.0%}")
+    columns[3].metric("Finished / failed", f"{stats['done']} / {stats['failed']}")
+    columns[4].metric("Calls saved", stats["coalesced"], help="Identical requests that joined one already running")
+    st.dataframe(
+        [{"job": job.id[:8], "user": job.owner, "status": job.status, "joined": job.joined, "waited s": round(job.wait_time, 1),
+          "ran s": round(job.run_time, 1)} for job in queue.jobs()[:50]],
+        use_container_width=True,
+    )
+
+    st.subheader("Analysis cache")
+    st.json(get_analysis_cache().stats())
+    st.subheader("Chat question cache")
+    st.json(get_question_cache().stats())
+
+    from image_utils import format_bytes
+
+    st.subheader("Session memory")
+    store = get_session_store()
+    totals = store.stats()
+    columns = st.columns(4)
+    columns[0].metric("Sessions", totals["sessions"])
+    columns[1].metric("In memory", format_bytes(totals["memory_bytes"]),
+                      help=f"Global budget {format_bytes(totals['global_budget'])}, "
+                           f"per session {format_bytes(totals['budget'])}")
+    columns[2].metric("Spilled to disk", format_bytes(totals["disk_bytes"]))
+    columns[3].metric("Spills / reloads", f"{totals['spills']} / {totals['reloads']}")
+    st.dataframe(
+        [{"session": row["session"][:8], "user": row["owner"], "memory": format_bytes(row["memory_bytes"]),
+          "disk": format_bytes(row["disk_bytes"]), "keys": row["keys"], "idle s": row["idle_seconds"]}
+         for row in store.session_stats()],
+        use_container_width=True,
+    )
+    st.caption("Keys marked * are on disk and load back when their session next reads them.")
+    st.subheader("OpenAI connection pool")
+    st.json(pool_stats(get_openai_client()))
+    if st.button("Refresh"):
+        st.rerun()
 
-        with st.chat_message("assistant"):
-            st.markdown(ai_response)
 
+import streamlit as st
 
+# Only the selected page's function runs, and it imports its own heavy dependencies
+PAGES = {
+    "Acne Analysis": acne_analysis,
+    "Analysis History": history_page,
+    "Profile Setup": profile_setup,
+    "AI Dermatologist": ai_dermatologist,
+    "About Page": about_page,
+    "Privacy Policy": privacy_policy,
+    "Terms and Conditions": terms_and_conditions,
+    "Contact Us": contact_us,
+    "FAQs": faq_page,
+}
+PUBLIC_PAGES = {
+    "Login": login,
+    "Sign-Up": sign_up,
+    "Password Recovery": password_recovery,
+}
+
+
+@st.cache_resource
+def start_metrics_endpoint():
+    # Serves /metrics (OpenMetrics text) and /metrics.json when METRICS_PORT is set
+    if metrics.METRICS_PORT:
+        return metrics.start_metrics_server(metrics.METRICS_PORT)
 
-import streamlit as st
 
 def main():
+    start_metrics_endpoint()
+    get_branding_assets()
     st.sidebar.title("Navigation")
 
     if "logged_in" not in st.session_state:
@@ -442,37 +864,20 @@ def main():
         # Logout button
         if st.sidebar.button("Logout 🚪"):
             st.session_state["logged_in"] = False
+            get_session_store().clear(session_key())
             st.rerun()
 
         # Page Navigation
-        page = st.sidebar.radio("Select Page", ["Acne Analysis", "Profile Setup", "AI Dermatologist", "About Page",
-                                                "Privacy Policy", "Terms and Conditions",
-                                                "Contact Us", "FAQs"])
-        if page == "Acne Analysis":
-            acne_analysis()
-        elif page == "Profile Setup":
-            profile_setup()
-        elif page == "AI Dermatologist":
-            ai_dermatologist()
-        elif page == "About Page":
-            about_page()
-        elif page == "Privacy Policy":
-            privacy_policy()
-        elif page == "Terms and Conditions":
-            terms_and_conditions()
-        elif page == "Contact Us":
-            contact_us()
-        elif page == "FAQs":
-            faq_page()
+        pages = PAGES
+        if st.session_state.get("username") in ADMIN_USERS:
+            pages = {**PAGES, "Admin": admin_page}
+        page = st.sidebar.radio("Select Page", list(pages), key="page")
+        pages[page]()
     else:
-        choice = st.sidebar.radio("Go to", ["Login", "Sign-Up", "Password Recovery"])
-        if choice == "Login":
-            login()
-        elif choice == "Sign-Up":
-            sign_up()
-        else:
-            password_recovery()
+        choice = st.sidebar.radio("Go to", list(PUBLIC_PAGES))
+        PUBLIC_PAGES[choice]()
 
 
 if __name__ == "__main__":
-    main()
+    with metrics.profile_script_run(), metrics.span("script_run"):
+        main()